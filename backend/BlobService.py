@@ -1,13 +1,73 @@
-import json
+import concurrent.futures
 import logging
+import os
+import re
+import threading
+import time
 
+import requests
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ResourceNotModifiedError,
+)
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient
-from util import cache_results
+from azure.storage.blob import BlobServiceClient, ContentSettings
+
+import codec
+import util
+from util import CACHE_TTL, NEGATIVE_CACHE_TTL, memory_cache, single_flight
 
 
 logging = logging.getLogger(__name__)
 
+## Read from the environment variable
+BLOB_POOL_SIZE = int(os.getenv("BLOB_POOL_SIZE", 32))
+BLOB_PREFETCH_WORKERS = int(os.getenv("BLOB_PREFETCH_WORKERS", 16))
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+## Process-wide clients: one credential, one pooled client per account and
+## one BlobService per (account, container), whose container is checked once
+_registry_lock = threading.Lock()
+_credential = None
+_clients = {}
+_services = {}
+
+
+## @brief Shared credential, token acquisition happens once per process
+## @return credential: DefaultAzureCredential
+def get_credential():
+    global _credential
+    with _registry_lock:
+        if _credential is None:
+            _credential = DefaultAzureCredential()
+        return _credential
+
+
+## @brief Shared BlobServiceClient of an account, on a pooled HTTP session
+## @param account_url: url of the storage account
+## @return blob_service_client: BlobServiceClient
+def get_blob_service_client(account_url: str) -> BlobServiceClient:
+    credential = get_credential()
+    with _registry_lock:
+        if account_url not in _clients:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=BLOB_POOL_SIZE, pool_maxsize=BLOB_POOL_SIZE
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _clients[account_url] = BlobServiceClient(
+                account_url=account_url,
+                credential=credential,
+                transport=RequestsTransport(session=session, session_owner=False),
+            )
+        return _clients[account_url]
+
 
 ## @classname BlobService
 ## @brief Class to handle blob storage
@@ -17,9 +77,7 @@ class BlobService:
     ## @param connection_string: connection string to blob storage
     def __init__(self, account_name: str, container_name="momentum-strategy") -> None:
         self.account_url = f"https://{account_name}.blob.core.windows.net/"
-        self.blob_service_client = BlobServiceClient(
-            account_url=self.account_url, credential=DefaultAzureCredential()
-        )
+        self.blob_service_client = get_blob_service_client(self.account_url)
         self.container_name = container_name
         self.container_client = self.blob_service_client.get_container_client(
             self.container_name
@@ -28,28 +86,195 @@ class BlobService:
             logging.info("%s container already exists", self.container_name)
         else:
             logging.info("%s container does not exist", self.container_name)
-            self.container_client.create_container()
+            try:
+                self.container_client.create_container()
+            except ResourceExistsError:
+                ## created by another worker in the meantime
+                pass
+
+    ## @classmethod _cache_key
+    ## @brief Key of a blob in util.memory_cache
+    ## @param blob_name: name of the blob
+    def _cache_key(self, blob_name: str):
+        return ("blob", self.account_url, self.container_name, blob_name)
+
+    ## @brief Key of a blob in Redis, shared by the replicas
+    def _shared_key(self, blob_name: str):
+        return f"blob:{self.account_url}/{self.container_name}/{blob_name}"
+
+    ## @classmethod _cache_blob
+    ## @brief Keep blob data in the process as (fresh until, etag, data), missing
+    ## blobs are fresh for a shorter time; stale entries stay until evicted so
+    ## they can be revalidated by their etag
+    ## @param blob_name: name of the blob
+    ## @param etag: etag of the blob, None if it does not exist
+    ## @param blob_data: decoded blob data, None if it does not exist
+    def _cache_blob(self, blob_name: str, etag, blob_data):
+        ttl = CACHE_TTL if etag is not None else NEGATIVE_CACHE_TTL
+        if etag is not None and util.redis_client is not None:
+            ## with Redis as L2 the process copy is revalidated sooner, so an
+            ## upload by another replica shows up as it did with cache_results
+            ttl = min(ttl, util.L1_CACHE_TTL)
+        memory_cache.set(
+            self._cache_key(blob_name), (time.monotonic() + ttl, etag, blob_data)
+        )
+
+    ## @classmethod invalidate_blob
+    ## @brief Drop the cached data of a blob, the next read downloads it
+    ## @param blob_name: name of the blob
+    def invalidate_blob(self, blob_name: str):
+        memory_cache.pop(self._cache_key(blob_name))
+        util.shared_delete(self._shared_key(blob_name))
 
     ## @classmethod get_blob_data_if_exists
-    ## @brief Get blob data if exists
+    ## @brief Get blob data if exists, with one request: a 404 means missing and
+    ## an expired cache entry is revalidated by its etag
+    ## The data is the cached object itself, shared by every caller: read-only,
+    ## copy it before changing it, or read with get_blob_data_with_etag
+    ## Concurrent reads of a blob that is not fresh in the cache share one download;
+    ## a blob another replica downloaded is taken from Redis and only revalidated
     ## @param blob_name: name of the blob
     ## @return blob_data: blob data if exists else None
-    @cache_results
     def get_blob_data_if_exists(self, blob_name: str):
+        cached = memory_cache.get(self._cache_key(blob_name))
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[2]
+        return single_flight(
+            self._cache_key(blob_name), lambda: self._revalidate_blob(blob_name)
+        )
+
+    ## @classmethod _revalidate_blob
+    ## @brief Download a blob, or only check it by the etag of a stale cache entry
+    ## @param blob_name: name of the blob
+    ## @return blob_data: blob data if exists else None
+    def _revalidate_blob(self, blob_name: str):
+        cached = memory_cache.get(self._cache_key(blob_name))
+        if cached is not None and cached[0] > time.monotonic():
+            ## filled by the flight that just landed
+            return cached[2]
+        if cached is None:
+            ## another replica's copy, revalidated by its etag like a stale entry
+            shared = util.shared_get(self._shared_key(blob_name))
+            if shared is not None:
+                cached = (0, shared[0], shared[1])
         blob_client = self.container_client.get_blob_client(blob_name)
-        if blob_client.exists():
-            logging.info("%s blob already exists", blob_name)
-            return json.loads(blob_client.download_blob().readall())
-        logging.info("%s blob does not exist", blob_name)
-        return None
+        try:
+            if cached is not None and cached[1] is not None:
+                downloader = blob_client.download_blob(
+                    etag=cached[1], match_condition=MatchConditions.IfModified
+                )
+            else:
+                downloader = blob_client.download_blob()
+            blob_data = codec.decode(downloader.readall())
+            etag = downloader.properties.etag
+            util.shared_set(self._shared_key(blob_name), [etag, blob_data])
+        except ResourceNotModifiedError:
+            logging.info("%s blob not modified", blob_name)
+            etag, blob_data = cached[1], cached[2]
+        except ResourceNotFoundError:
+            logging.info("%s blob does not exist", blob_name)
+            etag, blob_data = None, None
+        self._cache_blob(blob_name, etag, blob_data)
+        return blob_data
 
     ## @classmethod upload_blob
-    ## @brief Upload blob data
+    ## @brief Upload blob data as compressed JSON, see codec
     ## @param blob_data: blob data to upload
     ## @param blob_name: name of the blob
-    def upload_blob(self, blob_data: dict, blob_name: str):
+    ## @param etag, match_condition: optional upload condition, see upload_blob_if_unchanged
+    def upload_blob(
+        self, blob_data: dict, blob_name: str, etag=None, match_condition=None
+    ):
         blob_client = self.container_client.get_blob_client(blob_name)
-        blob_client.upload_blob(json.dumps(blob_data, indent=2), overwrite=True)
+        data, content_encoding = codec.encode(blob_data)
+        try:
+            blob_client.upload_blob(
+                data,
+                overwrite=True,
+                content_settings=ContentSettings(
+                    content_type=codec.CONTENT_TYPE, content_encoding=content_encoding
+                ),
+                etag=etag,
+                match_condition=match_condition,
+            )
+        finally:
+            self.invalidate_blob(blob_name)
+
+    ## @classmethod get_blob_data_with_etag
+    ## @brief Get blob data and its etag for a read-modify-write, not cached
+    ## @param blob_name: name of the blob
+    ## @return (blob_data, etag): (None, None) if the blob does not exist
+    def get_blob_data_with_etag(self, blob_name: str):
+        blob_client = self.container_client.get_blob_client(blob_name)
+        try:
+            downloader = blob_client.download_blob()
+        except ResourceNotFoundError:
+            return None, None
+        return codec.decode(downloader.readall()), downloader.properties.etag
+
+    ## @classmethod upload_blob_if_unchanged
+    ## @brief Upload blob data only if nobody wrote the blob since it was read
+    ## @param blob_data: blob data to upload
+    ## @param blob_name: name of the blob
+    ## @param etag: etag of the read, None if the blob did not exist then
+    ## @return uploaded: False if another writer changed the blob in between
+    def upload_blob_if_unchanged(self, blob_data: dict, blob_name: str, etag) -> bool:
+        try:
+            if etag is None:
+                self.upload_blob(
+                    blob_data, blob_name, match_condition=MatchConditions.IfMissing
+                )
+            else:
+                self.upload_blob(
+                    blob_data,
+                    blob_name,
+                    etag=etag,
+                    match_condition=MatchConditions.IfNotModified,
+                )
+        except (ResourceModifiedError, ResourceExistsError):
+            logging.info("%s changed since it was read", blob_name)
+            return False
+        return True
+
+    ## @classmethod get_blob_bytes_if_exists
+    ## @brief Get raw blob content if exists, not cached
+    ## @param blob_name: name of the blob
+    ## @return blob_bytes: blob content if exists else None
+    def get_blob_bytes_if_exists(self, blob_name: str):
+        return self.get_blob_bytes_with_etag(blob_name)[0]
+
+    ## @classmethod get_blob_bytes_with_etag
+    ## @brief Get raw blob content and the etag of that version, not cached
+    ## @param blob_name: name of the blob
+    ## @return (blob_bytes, etag): (None, None) if the blob does not exist
+    def get_blob_bytes_with_etag(self, blob_name: str):
+        blob_client = self.container_client.get_blob_client(blob_name)
+        try:
+            downloader = blob_client.download_blob()
+            return downloader.readall(), downloader.properties.etag
+        except ResourceNotFoundError:
+            logging.info("%s blob does not exist", blob_name)
+            return None, None
+
+    ## @classmethod get_blob_etag
+    ## @brief Etag of the current version of a blob, without downloading it
+    ## @param blob_name: name of the blob
+    ## @return etag: None if the blob does not exist
+    def get_blob_etag(self, blob_name: str):
+        blob_client = self.container_client.get_blob_client(blob_name)
+        try:
+            return blob_client.get_blob_properties().etag
+        except ResourceNotFoundError:
+            return None
+
+    ## @classmethod upload_bytes
+    ## @brief Upload raw blob content
+    ## @param data: bytes to upload
+    ## @param blob_name: name of the blob
+    def upload_bytes(self, data: bytes, blob_name: str):
+        blob_client = self.container_client.get_blob_client(blob_name)
+        blob_client.upload_blob(data, overwrite=True)
+        self.invalidate_blob(blob_name)
 
     ## @classmethod list_blobs
     ## @brief List all blobs
@@ -58,3 +283,80 @@ class BlobService:
         blob_list = self.container_client.list_blobs(name_starts_with=file_prefix)
         ## just return the blob name
         return [blob.name for blob in blob_list]
+
+    ## @classmethod list_blob_dates
+    ## @brief List the dated blobs of a prefix with one listing
+    ## @param file_prefix: e.g. "portfolio-on-", the date must follow it
+    ## @param suffix: e.g. ".json", or a tuple of suffixes
+    ## @return blob_names: blob name keyed by its YYYY-MM-DD date
+    def list_blob_dates(self, file_prefix: str, suffix=".json"):
+        suffixes = (suffix,) if isinstance(suffix, str) else tuple(suffix)
+        blob_names = {}
+        for blob_name in self.list_blobs(file_prefix):
+            date = blob_name[len(file_prefix) :]
+            for suffix in suffixes:
+                if date.endswith(suffix):
+                    date = date[: len(date) - len(suffix)]
+                    if DATE_PATTERN.fullmatch(date):
+                        blob_names.setdefault(date, blob_name)
+                    break
+        return blob_names
+
+    ## @classmethod prefetch_blobs
+    ## @brief Download JSON blobs concurrently into the get_blob_data_if_exists cache
+    ## @param blob_names: names of the blobs
+    ## @return blob_data: blob data keyed by blob name, blobs that failed are left
+    ## out; read-only like get_blob_data_if_exists
+    def prefetch_blobs(self, blob_names):
+        def _download(blob_name):
+            blob_client = self.container_client.get_blob_client(blob_name)
+            downloader = blob_client.download_blob()
+            blob_data = codec.decode(downloader.readall())
+            self._cache_blob(blob_name, downloader.properties.etag, blob_data)
+            util.shared_set(
+                self._shared_key(blob_name), [downloader.properties.etag, blob_data]
+            )
+            return blob_data
+
+        blob_data = {}
+        blob_names = list(blob_names)
+        if not blob_names:
+            return blob_data
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(BLOB_PREFETCH_WORKERS, len(blob_names))
+        ) as executor:
+            futures = {
+                executor.submit(_download, blob_name): blob_name
+                for blob_name in blob_names
+            }
+            for future in concurrent.futures.as_completed(futures):
+                blob_name = futures[future]
+                try:
+                    blob_data[blob_name] = future.result()
+                except Exception as e:  ## pylint: disable=broad-exception-caught
+                    logging.error("Failed to prefetch %s: %s", blob_name, e)
+                    continue
+        logging.info("Prefetched %d/%d blobs", len(blob_data), len(blob_names))
+        return blob_data
+
+
+## @brief Shared BlobService of an account and container
+## @param account_name: name of the storage account
+## @param container_name: name of the container
+## @return blob_service: BlobService
+def get_blob_service(account_name: str, container_name="momentum-strategy"):
+    key = (account_name, container_name)
+    blob_service = _services.get(key)
+    if blob_service is None:
+        blob_service = BlobService(account_name, container_name)
+        with _registry_lock:
+            blob_service = _services.setdefault(key, blob_service)
+    return blob_service
+
+
+## @brief Create the shared clients and check the containers, e.g. at startup
+## @param account_name: name of the storage account
+## @param container_names: containers to check
+def warm_blob_services(account_name: str, container_names):
+    for container_name in container_names:
+        get_blob_service(account_name, container_name)
@@ -1,6 +1,7 @@
 """
 This module defines a Flask app.
 """
+
 import os
 import sys
 import datetime
@@ -14,8 +15,13 @@ from flask import Flask, abort, jsonify, request, send_from_directory, session
 from flask_session import Session
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from util import cache_results, redis_client  ## pylint: disable=import-error
+from util import (  ## pylint: disable=import-error
+    cache_results,
+    memory_cache,
+    redis_client,
+)
 import business  ## pylint: disable=import-error
+import universes  ## pylint: disable=import-error
 
 
 app = Flask(__name__, static_folder=os.path.join(os.getcwd(), "frontend/build"))
@@ -72,6 +78,38 @@ def static_file(path):
         return send_from_directory(app.static_folder, "index.html")
 
 
+@app.route("/universes", methods=["GET"])
+@login_required
+def universes_json():
+    """
+    Returns the registered universes and the ones built every day.
+    """
+    return (
+        jsonify(
+            {
+                "universes": [
+                    {"name": universe.name, "label": universe.label}
+                    for universe in universes.UNIVERSES.values()
+                ],
+                "generated": [
+                    universe.name for universe in universes.GENERATE_UNIVERSES
+                ],
+                "default": universes.DEFAULT,
+            }
+        ),
+        200,
+    )
+
+
+@app.route("/cache/stats", methods=["GET"])
+@login_required
+def cache_stats():
+    """
+    Returns the size, evictions and hit ratio of the in-process cache.
+    """
+    return jsonify(memory_cache.stats()), 200
+
+
 @app.route("/nifty200/<datestr>", methods=["GET"])
 @login_required
 def nifty200_json(datestr=None):
@@ -81,7 +119,9 @@ def nifty200_json(datestr=None):
     validate_date(datestr)
 
     json_result = business.get_nifty200(
-        azure_blob_account_name="stockstrategies", request_date=datestr
+        azure_blob_account_name="stockstrategies",
+        request_date=datestr,
+        universe=requested_universe(),
     )
     if json_result:
         return jsonify(json_result), 200
@@ -110,6 +150,7 @@ def portfolio_json_with_params(datestr=None, numstocks=None, investment=None):
         request_date=datestr,
         num_stocks=numstocks,
         investment=investment,
+        universe=requested_universe(),
     )
     json_result = {
         "portfolio": porfolio_data,
@@ -147,12 +188,87 @@ def rebalance_json_with_params(
         to_date=fromDate,
         num_stocks=numstocks,
         investment=investment,
+        universe=requested_universe(),
     )
     if json_result:
         return jsonify(json_result), 200
     return jsonify({"error": "No portfolio data found"}), 400
 
 
+@app.route("/rebalances/<numstocks>/<investment>", methods=["POST"])
+@login_required
+def rebalances_json_with_params(numstocks=None, investment=None):
+    """
+    Returns the rebalances of many date pairs as a JSON list, None for missing pairs.
+    Body: {"pairs": [["YYYY-MM-DD", "YYYY-MM-DD"], ...]}, as (from date, to date)
+    """
+    try:
+        numstocks = int(numstocks)
+        investment = float(investment)
+    except ValueError:
+        abort(
+            400,
+            description="Invalid numstocks or investment. Expected integer and float respectively.",
+        )
+    body = request.get_json(silent=True) or {}
+    pairs = body.get("pairs")
+    if (
+        not isinstance(pairs, list)
+        or not 0 < len(pairs) <= 1000
+        or not all(
+            isinstance(pair, list)
+            and len(pair) == 2
+            and all(isinstance(date, str) and date for date in pair)
+            for pair in pairs
+        )
+    ):
+        abort(400, description="pairs must be a list of 1 to 1000 date pairs")
+    for from_date, to_date in pairs:
+        validate_date(from_date)
+        validate_date(to_date)
+
+    json_result = business.get_rebalances_with_params(
+        azure_blob_account_name="stockstrategies",
+        pairs=[tuple(pair) for pair in pairs],
+        num_stocks=numstocks,
+        investment=investment,
+        universe=requested_universe(),
+    )
+    if any(json_result):
+        return jsonify(json_result), 200
+    return jsonify({"error": "No portfolio data found"}), 400
+
+
+@app.route("/weights/<datestr>", methods=["POST"])
+@login_required
+def weights_json(datestr=None):
+    """
+    Scores a day's stocks under a batch of weightings and returns the top N of each.
+    Body: {"weightings": [{"blend": [r, v, s], "horizon": [1y, 1mo, 1w]}], "top_n": 15}
+    """
+    validate_date(datestr)
+    body = request.get_json(silent=True) or {}
+    weightings = body.get("weightings")
+    try:
+        top_n = int(body.get("top_n", 15))
+        if not isinstance(weightings, list) or not 0 < len(weightings) <= 1000:
+            raise ValueError("weightings must be a list of 1 to 1000 items")
+        if not all(isinstance(weighting, dict) for weighting in weightings):
+            raise ValueError("each weighting must be an object")
+        json_result = business.score_weightings(
+            azure_blob_account_name="stockstrategies",
+            request_date=datestr,
+            weightings=weightings,
+            top_n=top_n,
+            universe=requested_universe(),
+        )
+    except (TypeError, ValueError) as e:
+        abort(400, description=f"Invalid weightings: {e}")
+    if json_result:
+        return jsonify(json_result), 200
+    return jsonify({"error": "No NIFTY 200 data found"}), 400
+
+
 @app.route("/register", methods=["POST"])
 def register():
     """Registers a new user by adding their username and password to Redis."""
@@ -279,6 +395,7 @@ def scorecard(datestr=None):
         return jsonify(json_result), 200
     return jsonify({"error": "No score card data found"}), 400
 
+
 @app.route("/stocknews/<datestr>", methods=["GET"])
 @login_required
 def stocknews(datestr=None):
@@ -294,6 +411,7 @@ def stocknews(datestr=None):
         return jsonify(json_result), 200
     return jsonify({"error": "No stock news data found"}), 400
 
+
 @cache_results
 def get_connection_string():
     """
@@ -324,6 +442,22 @@ def generate_portfolio():
     logging.info("Stock news successfully built!")
 
 
+def refresh_universe():
+    """
+    Refreshes the 1w horizon and scores of today's stocks during market hours.
+    """
+    business.refresh_todays_universe(azure_blob_account_name="stockstrategies")
+    logging.info("Intraday refresh done!")
+
+
+def requested_universe():
+    """Universe of the `universe` query parameter, the default one if absent."""
+    name = request.args.get("universe", universes.DEFAULT)
+    if name not in universes.UNIVERSES:
+        abort(400, description=f"Unknown universe {name}.")
+    return name
+
+
 def validate_date(datestr):
     """Validates the date format."""
     try:
@@ -336,9 +470,13 @@ def validate_date(datestr):
 if __name__ == "__main__":
     if len(sys.argv) == 2 and sys.argv[1] == "generate":
         generate_portfolio()
+    elif len(sys.argv) == 2 and sys.argv[1] == "refresh":
+        refresh_universe()
     elif len(sys.argv) == 2 and sys.argv[1] == "debug":
         ## Debug
+        business.warm_up(azure_blob_account_name="stockstrategies")
         app.run(debug=True, host="0.0.0.0", port=8000)
     else:
         ## Production
+        business.warm_up(azure_blob_account_name="stockstrategies")
         serve(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,136 @@
+"""
+Benchmark of the Redis payload serializers of cache_results.
+
+Encodes and decodes real universe snapshots with the legacy `json.dumps`
+text path and with every serializer the installed packages support (see
+`codec.available_serializers`), and reports the median encode / decode time,
+the payload size and, when Redis is reachable, the memory Redis reports for
+the stored key (`MEMORY USAGE`).
+
+    python bench_cache.py --file nifty200-symbols-2025-01-02.json
+    python bench_cache.py --account stockstrategies --date 2025-01-02 --universe nifty500
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import codec
+import universes
+import util
+
+
+class LegacyJson:
+    """The json.dumps / json.loads text path cache_results used before."""
+
+    name = "json-text"
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+def load_records(args):
+    """Stock records of a saved stock list or of a stored snapshot."""
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    import business  ## pylint: disable=import-outside-toplevel
+
+    blob_service = business.get_blob_service(args.account)
+    return business.load_universe.__wrapped__(blob_service, args.date, args.universe)
+
+
+def _median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000.0
+
+
+def redis_memory(payload, key="bench_cache:payload"):
+    """Bytes Redis uses for a key holding the payload, None without Redis."""
+    if util.redis_client is None:
+        return None
+    try:
+        util.redis_client.set(key, payload)
+        return util.redis_client.memory_usage(key)
+    finally:
+        util.redis_client.delete(key)
+
+
+def benchmark(records, serializers, repeat):
+    results = []
+    for serializer in serializers:
+        payload = serializer.dumps(records)
+        ## compared as JSON text, NaN != NaN but both dump as NaN
+        round_trip = json.dumps(serializer.loads(payload)) == json.dumps(records)
+        results.append(
+            {
+                "serializer": serializer.name,
+                "encode_ms": round(
+                    _median_ms(lambda s=serializer: s.dumps(records), repeat), 3
+                ),
+                "decode_ms": round(
+                    _median_ms(lambda s=serializer, p=payload: s.loads(p), repeat), 3
+                ),
+                "bytes": len(payload),
+                "redis_bytes": redis_memory(payload),
+                "round_trip": round_trip,
+            }
+        )
+    return results
+
+
+def print_table(results):
+    baseline = results[0]
+    print(
+        f"{'serializer':<16}{'encode ms':>11}{'decode ms':>11}"
+        f"{'bytes':>11}{'redis bytes':>13}{'vs json':>9}  round trip"
+    )
+    for row in results:
+        redis_bytes = "-" if row["redis_bytes"] is None else row["redis_bytes"]
+        print(
+            f"{row['serializer']:<16}{row['encode_ms']:>11}{row['decode_ms']:>11}"
+            f"{row['bytes']:>11}{redis_bytes:>13}"
+            f"{row['bytes'] / baseline['bytes']:>9.2f}  {row['round_trip']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="stock list JSON saved by get_stocks")
+    source.add_argument("--account", help="storage account of the snapshots")
+    parser.add_argument("--date", help="YYYY-MM-DD of the snapshot, with --account")
+    parser.add_argument("--universe", default=universes.DEFAULT)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--serializers",
+        nargs="*",
+        default=codec.available_serializers(),
+        help="serializer names, default all installed",
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    if args.account and not args.date:
+        parser.error("--date is required with --account")
+
+    records = load_records(args)
+    if not records:
+        parser.error("no snapshot found")
+    results = benchmark(
+        records,
+        [LegacyJson()] + [codec.Serializer(name) for name in args.serializers],
+        args.repeat,
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{len(records)} records, median of {args.repeat} runs")
+        print_table(results)
@@ -1,12 +1,27 @@
+import concurrent.futures
 import datetime
 import json
 import logging
+import os
+import threading
 from typing import Dict, List
 
+import redis
+
+import codec
 import get_stocks as strategy
 import scorecard
+import scoring
+import snapshot
 import stocks_news
-from BlobService import BlobService
+import telemetry
+import trading_calendar
+import universes
+import util
+from BlobService import BlobService, get_blob_service, warm_blob_services
+from rebalance import rebalance_many
+from trading_calendar import DateManifest
+from util import cache_results
 
 logging = logging.getLogger(__name__)
 
@@ -15,34 +30,488 @@ def round_off(value: float) -> float:
     return round(value, 2)
 
 
-def build_todays_portfolio(
-    azure_blob_account_name: str, NUM_STOCKS: int = None, INVESTMENT_AMOUNT: int = None
+## Containers every worker talks to, checked once at startup by warm_up
+BLOB_CONTAINERS = ("momentum-strategy", "nifty-scorecards", "stock-news")
+
+
+## Create the shared blob clients and check the containers before serving
+def warm_up(azure_blob_account_name: str):
+    try:
+        warm_blob_services(azure_blob_account_name, BLOB_CONTAINERS)
+    except Exception as e:  ## pylint: disable=broad-exception-caught
+        ## requests retry the clients they need, do not keep the app from starting
+        logging.error("Failed to warm up blob clients: %s", e)
+
+
+def todays_date() -> str:
+    return datetime.datetime.today().strftime("%Y-%m-%d")
+
+
+## Columnar snapshot blob and the legacy JSON blob of older dates
+def universe_blob_names(request_date: str, universe: str = universes.DEFAULT):
+    base_name = universes.get_universe(universe).snapshot_base_name(request_date)
+    return f"{base_name}.npz", f"{base_name}.json"
+
+
+RSI_STATE_PREFIX = "all_symbols/rsi-state"
+
+
+## Dated blobs of a universe kept in the date manifest, with the suffixes
+## their listing is filtered by
+def dated_blob_prefixes(universe: str = universes.DEFAULT) -> Dict:
+    universe = universes.get_universe(universe)
+    return {
+        universe.snapshot_prefix: (".npz", ".json"),
+        universe.blob_name("portfolio-on"): ".json",
+        universe.blob_name("rebalances/rebalance-on"): ".json",
+    }
+
+
+## Dates of the blobs written by the generate job; prefixes the manifest does
+## not track yet, e.g. before the first run that writes it, are listed once
+def load_date_manifest(
+    blob_service: BlobService, prefixes: Dict = None, fresh: bool = False
+) -> DateManifest:
+    if fresh:
+        ## read the blob itself, a cached copy could predate the previous run
+        data = blob_service.get_blob_bytes_if_exists(
+            trading_calendar.MANIFEST_BLOB_NAME
+        )
+        data = codec.decode(data) if data is not None else None
+    else:
+        data = blob_service.get_blob_data_if_exists(trading_calendar.MANIFEST_BLOB_NAME)
+    manifest = DateManifest.from_dict(data)
+    for prefix, suffix in (prefixes or {}).items():
+        if not manifest.tracks(prefix):
+            manifest.track(prefix, blob_service.list_blob_dates(f"{prefix}-", suffix))
+    return manifest
+
+
+## cache_results keys on the positional arguments, pass `universe` positionally
+@cache_results
+def load_universe(
+    blob_service: BlobService, request_date: str, universe: str = universes.DEFAULT
+) -> List:
+    npz_blob_name, json_blob_name = universe_blob_names(request_date, universe)
+    data = blob_service.get_blob_bytes_if_exists(npz_blob_name)
+    if data is not None:
+        return snapshot.to_records(snapshot.decode(data))
+    return blob_service.get_blob_data_if_exists(json_blob_name)
+
+
+## Price list of a day, reads only the symbol and price columns
+@cache_results
+def load_price_list(
+    blob_service: BlobService, request_date: str, universe: str = universes.DEFAULT
+) -> Dict:
+    npz_blob_name, json_blob_name = universe_blob_names(request_date, universe)
+    data = blob_service.get_blob_bytes_if_exists(npz_blob_name)
+    if data is not None:
+        return snapshot.price_list(data)
+    nifty200_symbols = blob_service.get_blob_data_if_exists(json_blob_name)
+    if nifty200_symbols:
+        return strategy.build_price_list(nifty200_symbols)
+    return None
+
+
+## Drop the cached loads of a day's snapshot once it is uploaded, callers may
+## pass the default universe or leave it out, so both keys go
+def invalidate_universe(
+    blob_service: BlobService, request_date: str, universe: str = universes.DEFAULT
 ):
-    # Initialize the BlobServiceClient
-    blob_service = BlobService(azure_blob_account_name)
+    for loader in (load_universe, load_price_list):
+        loader.invalidate(blob_service, request_date, universe)
+        if universe == universes.DEFAULT:
+            loader.invalidate(blob_service, request_date)
+    for kind in ("columns", "factors"):
+        util.memory_cache.pop(
+            _day_cache_key(kind, blob_service, request_date, universe)
+        )
 
-    # Define the name of the blob
-    blob_name = strategy.get_file_name("all_symbols/nifty200-symbols")
 
-    nifty200_symbols = blob_service.get_blob_data_if_exists(blob_name)
-    if nifty200_symbols is None:
-        logging.info("%s blob does not exist", blob_name)
-        ## Get the list of stocks
-        nifty200_symbols, tickertape_links = strategy.getStockList()
-        ## Upload the list of stocks
-        blob_service.upload_blob(nifty200_symbols, blob_name)
-        tickertake_file_blob_name = f"all_symbols/tickertape-links.json"
-        blob_service.upload_blob(tickertape_links, tickertake_file_blob_name)
-        nifty200_data = strategy.fetch_nifty_200_data()
-        if nifty200_data:
-            nifty200_data_blob_name = f"all_symbols/nifty200-data.json"
-            ## Upload the list of stocks
-            blob_service.upload_blob(nifty200_data, nifty200_data_blob_name)
-
-    if NUM_STOCKS is None or INVESTMENT_AMOUNT is None:
+def factor_blob_name(request_date: str, universe: str = universes.DEFAULT) -> str:
+    return universes.get_universe(universe).all_symbols_blob_name(
+        f"factors-{request_date}.npz"
+    )
+
+
+## Decoded data of a day kept in util.memory_cache, past days until evicted,
+## today's for CACHE_TTL as the intraday refresh still rewrites it
+def _day_cache_key(
+    kind: str,
+    blob_service: BlobService,
+    request_date: str,
+    universe: str = universes.DEFAULT,
+):
+    return ("day", kind, universe, blob_service.account_url, request_date)
+
+
+def _cached_by_day(
+    kind: str,
+    blob_service: BlobService,
+    request_date: str,
+    loader,
+    universe: str = universes.DEFAULT,
+):
+    key = _day_cache_key(kind, blob_service, request_date, universe)
+    value = util.memory_cache.get(key)
+    if value is not None:
+        return value
+
+    def _load():
+        ## concurrent misses share one download and decode
+        value = util.memory_cache.get(key)
+        if value is not None:
+            return value
+        value = loader()
+        if value is not None and request_date:
+            ttl = None if request_date < todays_date() else util.CACHE_TTL
+            util.memory_cache.set(key, value, ttl)
+        return value
+
+    return util.single_flight(key, _load)
+
+
+## (etag, columns) of the snapshot of a day, None for days stored only as
+## legacy JSON; the etag tells which version portfolios were built from
+def _load_snapshot(
+    blob_service: BlobService, request_date: str, universe: str = universes.DEFAULT
+):
+    def _load():
+        data, etag = blob_service.get_blob_bytes_with_etag(
+            universe_blob_names(request_date, universe)[0]
+        )
+        return (etag, snapshot.decode(data)) if data is not None else None
+
+    return _cached_by_day("columns", blob_service, request_date, _load, universe)
+
+
+## Snapshot columns of a day, None for days stored only as legacy JSON
+def load_universe_columns(
+    blob_service: BlobService, request_date: str, universe: str = universes.DEFAULT
+) -> Dict:
+    loaded = _load_snapshot(blob_service, request_date, universe)
+    return loaded[1] if loaded is not None else None
+
+
+def load_factor_matrix(
+    blob_service: BlobService, request_date: str, universe: str = universes.DEFAULT
+) -> scoring.FactorMatrix:
+    def _load():
+        data = blob_service.get_blob_bytes_if_exists(
+            factor_blob_name(request_date, universe)
+        )
+        if data is not None:
+            return scoring.FactorMatrix.decode(data)
+        nifty200_symbols = load_universe(blob_service, request_date, universe)
+        if not nifty200_symbols:
+            return None
+        return scoring.FactorMatrix.from_records(nifty200_symbols)
+
+    return _cached_by_day("factors", blob_service, request_date, _load, universe)
+
+
+## Portfolio of a day, picked straight from the snapshot columns when there are some
+## @return (portfolio, etag of the snapshot it was built from, None for legacy JSON)
+def build_portfolio_for_date(
+    blob_service: BlobService,
+    request_date: str,
+    num_stocks: int,
+    investment: float,
+    universe: str = universes.DEFAULT,
+):
+    loaded = _load_snapshot(blob_service, request_date, universe)
+    if loaded is not None:
+        snapshot_etag, columns = loaded
+        portfolio = strategy.build_portfolio_from_snapshot(
+            columns, N=num_stocks, investment=investment
+        )
+        return portfolio, snapshot_etag
+    nifty200_symbols = load_universe(blob_service, request_date, universe)
+    if nifty200_symbols:
+        portfolio = strategy.build_portfolio(
+            nifty200_symbols, N=num_stocks, investment=investment
+        )
+        return portfolio, None
+    return None, None
+
+
+## (num_stocks, investment) pairs materialized every day besides the user profiles
+DEFAULT_PORTFOLIO_GRID = [
+    (num_stocks, investment)
+    for num_stocks in (5, 10, 15, 20, 25, 30)
+    for investment in (100000, 500000, 1000000, 5000000)
+]
+
+## One writer for the portfolios of parameters seen for the first time
+_fill_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="portfolio-fill"
+)
+_pending_fills = set()
+_pending_fills_lock = threading.Lock()
+## Conditional uploads of a portfolio store before giving up on conflicts
+FILL_RETRIES = 5
+
+
+def portfolio_store_blob_name(
+    request_date: str, universe: str = universes.DEFAULT
+) -> str:
+    return universes.get_universe(universe).blob_name(
+        f"portfolios/portfolios-{request_date}.json"
+    )
+
+
+def portfolio_key(num_stocks: int, investment: float) -> str:
+    return f"{int(num_stocks)}|{float(investment):.2f}"
+
+
+## (num_stocks, investment) of the portfolios in a store
+def store_params(store: Dict) -> set:
+    return {
+        (int(num_stocks), float(investment))
+        for num_stocks, investment in (key.split("|") for key in store or {})
+    }
+
+
+## Distinct (num_stocks, investment) of all registered profiles plus the default grid
+def profile_portfolio_params() -> set:
+    params = set(DEFAULT_PORTFOLIO_GRID)
+    if util.redis_client is None:
+        return params
+    try:
+        user_profiles = util.redis_client.hvals("users_profile")
+    except redis.exceptions.ConnectionError as e:
+        logging.warning("Could not read user profiles: %s", e)
+        return params
+    for user_profile in user_profiles:
+        try:
+            user_profile = json.loads(user_profile)
+            params.add(
+                (int(user_profile["num_stocks"]), float(user_profile["investment"]))
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning("Skipping malformed user profile: %s", e)
+    return params
+
+
+## Build and upload the portfolios of a day for all `params`, keyed by portfolio_key;
+## the portfolios already in the store are rebuilt too, so a fill that lands
+## while the store is rebuilt is kept, from the current snapshot
+def materialize_portfolios(
+    blob_service: BlobService,
+    request_date: str,
+    params,
+    universe: str = universes.DEFAULT,
+) -> Dict:
+    columns = load_universe_columns(blob_service, request_date, universe)
+    if columns is None:
         return None
+    blob_name = portfolio_store_blob_name(request_date, universe)
+    for _ in range(FILL_RETRIES):
+        current, etag = blob_service.get_blob_data_with_etag(blob_name)
+        store = {}
+        for num_stocks, investment in sorted(set(params) | store_params(current)):
+            if num_stocks <= 0 or investment <= 0:
+                continue
+            try:
+                store[portfolio_key(num_stocks, investment)] = (
+                    strategy.build_portfolio_from_snapshot(
+                        columns, N=num_stocks, investment=investment
+                    )
+                )
+            except ValueError as e:
+                logging.warning("No portfolio for %s %s: %s", num_stocks, investment, e)
+        if blob_service.upload_blob_if_unchanged(store, blob_name, etag):
+            logging.info(
+                "Materialized %d %s portfolios for %s",
+                len(store),
+                universe,
+                request_date,
+            )
+            return store
+    logging.warning("Gave up materializing %s portfolios of %s", universe, request_date)
+    return None
+
+
+## Portfolio store of a day, cached in the process and revalidated by its etag,
+## read-only: fills work on a fresh copy
+def load_portfolio_store(
+    blob_service: BlobService, request_date: str, universe: str = universes.DEFAULT
+) -> Dict:
+    return blob_service.get_blob_data_if_exists(
+        portfolio_store_blob_name(request_date, universe)
+    )
+
+
+## Add one portfolio to the store of a day; replicas and the intraday refresh
+## write the same blob, so the upload only goes through if the blob is still
+## the one read, and a conflict reads it again. A portfolio built from a
+## snapshot the refresh has replaced since is dropped.
+def _fill_portfolio(
+    blob_service: BlobService,
+    request_date: str,
+    key: str,
+    portfolio,
+    universe: str = universes.DEFAULT,
+    snapshot_etag=None,
+):
+    blob_name = portfolio_store_blob_name(request_date, universe)
+    snapshot_blob_name = universe_blob_names(request_date, universe)[0]
+    try:
+        for _ in range(FILL_RETRIES):
+            if blob_service.get_blob_etag(snapshot_blob_name) != snapshot_etag:
+                logging.info(
+                    "%s snapshot of %s changed, dropping the fill of %s",
+                    universe,
+                    request_date,
+                    key,
+                )
+                return
+            store, etag = blob_service.get_blob_data_with_etag(blob_name)
+            store = dict(store or {})
+            if key in store:
+                logging.info("%s portfolio %s already filled", universe, key)
+                return
+            store[key] = portfolio
+            if blob_service.upload_blob_if_unchanged(store, blob_name, etag):
+                logging.info(
+                    "Filled %s portfolio %s of %s", universe, key, request_date
+                )
+                return
+        logging.warning(
+            "Gave up filling %s portfolio %s of %s", universe, key, request_date
+        )
+    except Exception as e:  ## pylint: disable=broad-exception-caught
+        logging.error("Failed to fill portfolio %s of %s: %s", key, request_date, e)
+    finally:
+        with _pending_fills_lock:
+            _pending_fills.discard((universe, request_date, key))
+
+
+## Materialized portfolio of a day; built on a miss and stored in the background
+def lookup_portfolio(
+    blob_service: BlobService,
+    request_date: str,
+    num_stocks: int,
+    investment: float,
+    universe: str = universes.DEFAULT,
+) -> List:
+    key = portfolio_key(num_stocks, investment)
+    store = load_portfolio_store(blob_service, request_date, universe)
+    if store is not None and key in store:
+        return store[key]
+    portfolio, snapshot_etag = build_portfolio_for_date(
+        blob_service, request_date, num_stocks, investment, universe
+    )
+    if portfolio is not None:
+        with _pending_fills_lock:
+            is_new = (universe, request_date, key) not in _pending_fills
+            _pending_fills.add((universe, request_date, key))
+        if is_new:
+            _fill_executor.submit(
+                _fill_portfolio,
+                blob_service,
+                request_date,
+                key,
+                portfolio,
+                universe,
+                snapshot_etag,
+            )
+    return portfolio
+
+
+## Most recent RSI smoothing state saved by a previous generate run
+def load_previous_rsi_state(
+    blob_service: BlobService, manifest: DateManifest, max_days: int = 7
+) -> Dict:
+    previous_date = manifest.previous(RSI_STATE_PREFIX, todays_date())
+    oldest_date = (
+        datetime.datetime.today() - datetime.timedelta(days=max_days)
+    ).strftime("%Y-%m-%d")
+    if previous_date is None or previous_date < oldest_date:
+        return {}
+    blob_name = f"{RSI_STATE_PREFIX}-{previous_date}.json"
+    rsi_state = blob_service.get_blob_data_if_exists(blob_name)
+    if rsi_state:
+        logging.info("Resuming RSI from %s", blob_name)
+        ## the run updates the state per symbol in place, not the cached blob
+        return {symbol: dict(states) for symbol, states in rsi_state.items()}
+    return {}
+
+
+## Stock lists of today's universes; the missing ones are fetched in one run that
+## shares the symbols they have in common, and uploaded per universe
+def build_todays_universes(
+    blob_service: BlobService, universe_names: List, manifest: DateManifest
+) -> Dict:
+    universe_lists = {}
+    missing = []
+    for name in universe_names:
+        data_items = load_universe(blob_service, todays_date(), name)
+        if data_items is None:
+            logging.info(
+                "%s blob does not exist", universe_blob_names(todays_date(), name)[0]
+            )
+            missing.append(universes.get_universe(name))
+        else:
+            universe_lists[name] = data_items
+            manifest.add(universes.get_universe(name).snapshot_prefix, todays_date())
+    if not missing:
+        return universe_lists
+
+    ## Get the list of stocks
+    rsi_state = load_previous_rsi_state(blob_service, manifest)
+    report = telemetry.RunReport()
+    fetched = strategy.getUniverseLists(
+        {universe.name: universe.url for universe in missing},
+        rsi_state=rsi_state,
+        report=report,
+        blob_service=blob_service,
+    )
+    for universe in missing:
+        nifty200_symbols, tickertape_links = fetched[universe.name]
+        ## Upload the list of stocks
+        blob_service.upload_bytes(
+            snapshot.encode(nifty200_symbols),
+            universe_blob_names(todays_date(), universe.name)[0],
+        )
+        blob_service.upload_bytes(
+            scoring.FactorMatrix.from_records(nifty200_symbols).encode(),
+            factor_blob_name(todays_date(), universe.name),
+        )
+        invalidate_universe(blob_service, todays_date(), universe.name)
+        manifest.add(universe.snapshot_prefix, todays_date())
+        blob_service.upload_blob(
+            tickertape_links,
+            universe.all_symbols_blob_name("tickertape-links.json"),
+        )
+        index_data = strategy.fetch_index_data(universe.ticker)
+        if index_data:
+            blob_service.upload_blob(index_data, universe.index_data_blob_name())
+        universe_lists[universe.name] = nifty200_symbols
+    blob_service.upload_blob(rsi_state, strategy.get_file_name(RSI_STATE_PREFIX))
+    manifest.add(RSI_STATE_PREFIX, todays_date())
+    blob_service.upload_blob(
+        report.to_dict(), strategy.get_file_name("all_symbols/run-report")
+    )
+    return universe_lists
+
+
+## Portfolio of today for one universe and its rebalance from the previous
+## portfolio in the date manifest, e.g. Friday's on a Monday
+def build_todays_universe_portfolio(
+    blob_service: BlobService,
+    universe: str,
+    nifty200_symbols: List,
+    NUM_STOCKS: int,
+    INVESTMENT_AMOUNT: int,
+    manifest: DateManifest,
+):
+    universe = universes.get_universe(universe)
+    portfolio_prefix = universe.blob_name("portfolio-on")
+    rebalance_prefix = universe.blob_name("rebalances/rebalance-on")
     ## Upload the portfolio
-    blob_name = strategy.get_file_name("portfolio-on")
+    blob_name = strategy.get_file_name(portfolio_prefix)
     portfolio = blob_service.get_blob_data_if_exists(blob_name)
     if portfolio is None:
         logging.info("%s blob does not exist", blob_name)
@@ -51,14 +520,17 @@ def build_todays_portfolio(
             nifty200_symbols, N=NUM_STOCKS, investment=INVESTMENT_AMOUNT
         )
         blob_service.upload_blob(portfolio, blob_name)
+    manifest.add(portfolio_prefix, todays_date())
 
     ## Generate Rebalance json
-    previous_day_blob_name = strategy.get_file_name("portfolio-on", days=1)
-    previous_day_portfolio = blob_service.get_blob_data_if_exists(
-        previous_day_blob_name
-    )
+    previous_date = manifest.previous(portfolio_prefix, todays_date())
+    previous_day_portfolio = None
+    if previous_date:
+        previous_day_portfolio = blob_service.get_blob_data_if_exists(
+            f"{portfolio_prefix}-{previous_date}.json"
+        )
     if previous_day_portfolio:
-        blob_name = strategy.get_file_name("rebalances/rebalance-on")
+        blob_name = strategy.get_file_name(rebalance_prefix)
         rebalance = blob_service.get_blob_data_if_exists(blob_name)
         if rebalance is None:
             logging.info("%s blob does not exist", blob_name)
@@ -69,12 +541,237 @@ def build_todays_portfolio(
             )
             ## Upload the rebalance json
             blob_service.upload_blob(rebalance, blob_name)
+        manifest.add(rebalance_prefix, todays_date())
 
     return portfolio
 
 
+## Build today's universes (GENERATE_UNIVERSES by default) and their portfolios
+## @return today's portfolio of the first universe, None without NUM_STOCKS
+def build_todays_portfolio(
+    azure_blob_account_name: str,
+    NUM_STOCKS: int = None,
+    INVESTMENT_AMOUNT: int = None,
+    universe_names: List = None,
+):
+    # Initialize the BlobServiceClient
+    blob_service = get_blob_service(azure_blob_account_name)
+    if universe_names is None:
+        universe_names = [universe.name for universe in universes.GENERATE_UNIVERSES]
+
+    prefixes = {RSI_STATE_PREFIX: ".json"}
+    for name in universe_names:
+        prefixes.update(dated_blob_prefixes(name))
+    manifest = load_date_manifest(blob_service, prefixes, fresh=True)
+    universe_lists = build_todays_universes(blob_service, universe_names, manifest)
+
+    ## Portfolios of every profile's parameters, so API requests are a lookup
+    params = profile_portfolio_params()
+    if NUM_STOCKS and INVESTMENT_AMOUNT:
+        params.add((NUM_STOCKS, INVESTMENT_AMOUNT))
+    for name in universe_names:
+        materialize_portfolios(blob_service, todays_date(), params, name)
+
+    portfolios = []
+    if NUM_STOCKS is not None and INVESTMENT_AMOUNT is not None:
+        portfolios = [
+            build_todays_universe_portfolio(
+                blob_service,
+                name,
+                universe_lists[name],
+                NUM_STOCKS,
+                INVESTMENT_AMOUNT,
+                manifest,
+            )
+            for name in universe_names
+        ]
+    blob_service.upload_blob(manifest.to_dict(), trading_calendar.MANIFEST_BLOB_NAME)
+    ## Value of every recent portfolio at today's prices, for the history view
+    for name in universe_names:
+        try:
+            append_nav_series(
+                blob_service,
+                todays_date(),
+                strategy.build_price_list(universe_lists[name]),
+                name,
+                manifest,
+            )
+        except Exception as e:  ## pylint: disable=broad-exception-caught
+            ## the history view falls back to the price lists without it
+            logging.error("Failed to update the %s NAV series: %s", name, e)
+    return portfolios[0] if portfolios else None
+
+
+## Daily values of the recent portfolio-on portfolios, kept in one blob:
+## {"schema_version": 1, "portfolios": {start_date: {"cost": purchase value,
+## "holdings": [[symbol, shares], ...], "series": [{"date", "value",
+## "per_change"}, ...]}}}, appended to by every generate run
+NAV_SCHEMA_VERSION = 1
+## Read from the environment variable
+NAV_HISTORY_DAYS = int(os.getenv("NAV_HISTORY_DAYS", 120))
+
+
+def nav_blob_name(universe: str = universes.DEFAULT) -> str:
+    return universes.get_universe(universe).blob_name("nav/portfolio-nav.json")
+
+
+## (per_change, value, purchase value) of a portfolio at a price list
+def portfolio_value(portfolio, price_list: Dict):
+    today_value = sum(
+        [stock["shares"] * price_list[stock["symbol"]] for stock in portfolio]
+    )
+    previous_date_value = sum([stock["shares"] * stock["price"] for stock in portfolio])
+    ## return percentage change
+    pc = round_off((today_value - previous_date_value) / previous_date_value * 100)
+    return pc, today_value, previous_date_value
+
+
+def _append_nav_point(entry: Dict, request_date: str, price_list: Dict):
+    if not entry["cost"]:
+        return
+    try:
+        ## same sum as portfolio_value, in portfolio order
+        today_value = sum(
+            [shares * price_list[symbol] for symbol, shares in entry["holdings"]]
+        )
+    except KeyError as e:
+        logging.warning("No price for %s on %s", e, request_date)
+        return
+    point = {
+        "date": request_date,
+        "value": today_value,
+        "per_change": round_off((today_value - entry["cost"]) / entry["cost"] * 100),
+    }
+    series = entry["series"]
+    ## generate can run more than once a day, the latest run wins
+    if series and series[-1]["date"] == request_date:
+        series[-1] = point
+    elif not series or series[-1]["date"] < request_date:
+        series.append(point)
+
+
+## Append the value on request_date of every portfolio of the last
+## NAV_HISTORY_DAYS to the NAV series, backfilling portfolios not tracked yet
+def append_nav_series(
+    blob_service: BlobService,
+    request_date: str,
+    price_list: Dict,
+    universe: str = universes.DEFAULT,
+    manifest: DateManifest = None,
+) -> Dict:
+    if manifest is None:
+        manifest = load_date_manifest(blob_service, dated_blob_prefixes(universe))
+    portfolio_prefix = universes.get_universe(universe).blob_name("portfolio-on")
+    snapshot_prefix = universes.get_universe(universe).snapshot_prefix
+    ## read the blob itself, a cached copy could predate the previous run
+    data = blob_service.get_blob_bytes_if_exists(nav_blob_name(universe))
+    nav = codec.decode(data) if data is not None else None
+    if nav is None or nav.get("schema_version") != NAV_SCHEMA_VERSION:
+        nav = {"schema_version": NAV_SCHEMA_VERSION, "portfolios": {}}
+    tracked = nav["portfolios"]
+
+    first_date = (
+        datetime.datetime.strptime(request_date, "%Y-%m-%d")
+        - datetime.timedelta(days=NAV_HISTORY_DAYS)
+    ).strftime("%Y-%m-%d")
+    available = {
+        date: f"{portfolio_prefix}-{date}.json"
+        for date in manifest.dates(portfolio_prefix, first_date, request_date)
+    }
+    new_dates = sorted(date for date in available if date not in tracked)
+    prefetched = blob_service.prefetch_blobs(available[date] for date in new_dates)
+    for start_date in new_dates:
+        portfolio = prefetched.get(available[start_date])
+        if not portfolio:
+            continue
+        entry = {
+            "cost": sum([stock["shares"] * stock["price"] for stock in portfolio]),
+            "holdings": [[stock["symbol"], stock["shares"]] for stock in portfolio],
+            "series": [],
+        }
+        ## values of the days before request_date, from their stored price lists
+        for this_date in manifest.dates(snapshot_prefix, start_date, request_date):
+            if this_date == start_date or this_date == request_date:
+                continue
+            past_price_list = load_price_list(blob_service, this_date, universe)
+            if past_price_list:
+                _append_nav_point(entry, this_date, past_price_list)
+        tracked[start_date] = entry
+        logging.info("Tracking NAV of the %s portfolio of %s", universe, start_date)
+
+    for start_date, entry in tracked.items():
+        if start_date < request_date:
+            _append_nav_point(entry, request_date, price_list)
+    nav["portfolios"] = {
+        start_date: tracked[start_date]
+        for start_date in sorted(tracked)
+        if start_date >= first_date
+    }
+    nav["updated_at"] = request_date
+    blob_service.upload_blob(nav, nav_blob_name(universe))
+    return nav
+
+
+## Intraday refresh of today's universes, refetching only the 1w horizon
+def refresh_todays_universe(
+    azure_blob_account_name: str, universe_names: List = None
+) -> Dict:
+    if not strategy.is_market_open():
+        logging.info("Market is closed, skipping intraday refresh")
+        return None
+    blob_service = get_blob_service(azure_blob_account_name)
+    if universe_names is None:
+        universe_names = [universe.name for universe in universes.GENERATE_UNIVERSES]
+    universe_lists = {}
+    for name in universe_names:
+        blob_name, _ = universe_blob_names(todays_date(), name)
+        ## read the blob itself, a cached copy could predate the previous refresh
+        data = blob_service.get_blob_bytes_if_exists(blob_name)
+        if data is None:
+            logging.info("%s blob does not exist, run generate first", blob_name)
+            continue
+        universe_lists[name] = (
+            snapshot.to_records(snapshot.decode(data)),
+            universes.get_universe(name).url,
+        )
+    if not universe_lists:
+        return None
+    refreshed = strategy.refresh_universe_lists(
+        universe_lists, blob_service=blob_service
+    )
+    for name, nifty200_symbols in refreshed.items():
+        blob_service.upload_bytes(
+            snapshot.encode(nifty200_symbols),
+            universe_blob_names(todays_date(), name)[0],
+        )
+        blob_service.upload_bytes(
+            scoring.FactorMatrix.from_records(nifty200_symbols).encode(),
+            factor_blob_name(todays_date(), name),
+        )
+        invalidate_universe(blob_service, todays_date(), name)
+        ## scores moved, rebuild the portfolios already materialized today
+        store = load_portfolio_store(blob_service, todays_date(), name)
+        materialize_portfolios(
+            blob_service,
+            todays_date(),
+            store_params(store) or profile_portfolio_params(),
+            name,
+        )
+        ## prices moved too, today's NAV point is replaced by the refreshed one
+        try:
+            append_nav_series(
+                blob_service,
+                todays_date(),
+                strategy.build_price_list(nifty200_symbols),
+                name,
+            )
+        except Exception as e:  ## pylint: disable=broad-exception-caught
+            logging.error("Failed to update the %s NAV series: %s", name, e)
+    return refreshed
+
+
 def get_portfolio(azure_blob_account_name: str, request_date: str = None) -> str:
-    blob_service = BlobService(azure_blob_account_name)
+    blob_service = get_blob_service(azure_blob_account_name)
     if request_date:
         portfolio_blob_name = f"portfolio-on-{request_date}.json"
     else:
@@ -86,31 +783,28 @@ def get_portfolio(azure_blob_account_name: str, request_date: str = None) -> str
     )
 
 
-def get_nifty200(azure_blob_account_name: str, request_date: str = None) -> Dict:
-    blob_service = BlobService(azure_blob_account_name)
-    if request_date:
-        blob_name = f"all_symbols/nifty200-symbols-{request_date}.json"
-    else:
-        blob_name = strategy.get_file_name("all_symbols/nifty200-symbols")
-    logging.info("Nifty200 blob name: %s", blob_name)
-    nifty200_symbols = blob_service.get_blob_data_if_exists(blob_name)
-    if nifty200_symbols:
-        return strategy.build_price_list(nifty200_symbols)
-    return None
+def get_nifty200(
+    azure_blob_account_name: str,
+    request_date: str = None,
+    universe: str = universes.DEFAULT,
+) -> Dict:
+    blob_service = get_blob_service(azure_blob_account_name)
+    request_date = request_date or todays_date()
+    logging.info(
+        "Universe blob name: %s", universe_blob_names(request_date, universe)[0]
+    )
+    return load_price_list(blob_service, request_date, universe)
 
 
 def get_rebalance(azure_blob_account_name: str, from_date: str, to_date: str) -> Dict:
-    blob_service = BlobService(azure_blob_account_name)
-    blob_name = f"all_symbols/nifty200-symbols-{to_date}.json"
+    blob_service = get_blob_service(azure_blob_account_name)
     from_blob_name = f"portfolio-on-{from_date}.json"
     to_blob_name = f"portfolio-on-{to_date}.json"
-    nifty200_symbols = blob_service.get_blob_data_if_exists(blob_name)
+    price_list = load_price_list(blob_service, to_date)
     from_portfolio = blob_service.get_blob_data_if_exists(from_blob_name)
     to_portfolio = blob_service.get_blob_data_if_exists(to_blob_name)
-    if nifty200_symbols and from_portfolio and to_portfolio:
-        return strategy.rebalance_portfolio(
-            from_portfolio, to_portfolio, strategy.build_price_list(nifty200_symbols)
-        )
+    if price_list and from_portfolio and to_portfolio:
+        return strategy.rebalance_portfolio(from_portfolio, to_portfolio, price_list)
     return None
 
 
@@ -120,7 +814,7 @@ def view_portfolio(
     portfolio, portfolio_blob_name = get_portfolio(
         azure_blob_account_name, request_date
     )
-    blob_service = BlobService(azure_blob_account_name)
+    blob_service = get_blob_service(azure_blob_account_name)
     if portfolio:
         # Generate an HTML table
         table_html = """
@@ -345,13 +1039,11 @@ def view_portfolio(
                 strategy.get_file_name("portfolio-on")
             )
             if current_portfolio:
-                blob_name = strategy.get_file_name("all_symbols/nifty200-symbols")
-                nifty200_symbols = blob_service.get_blob_data_if_exists(blob_name)
                 try:
                     rebalance = strategy.rebalance_portfolio(
                         portfolio,
                         current_portfolio,
-                        strategy.build_price_list(nifty200_symbols),
+                        load_price_list(blob_service, todays_date()),
                     )
                 except Exception as e:
                     logging.error(e)
@@ -402,79 +1094,112 @@ def view_portfolio(
         current_portfolio = blob_service.get_blob_data_if_exists(
             strategy.get_file_name("portfolio-on")
         )
-        blob_name = strategy.get_file_name("all_symbols/nifty200-symbols")
-        nifty200_symbols = blob_service.get_blob_data_if_exists(blob_name)
-        while current_portfolio and nifty200_symbols:
-            ## Keep going back in time in YYYY-MM-DD format
-            current_date = datetime.datetime.strptime(
-                current_date, "%Y-%m-%d"
-            ) - datetime.timedelta(days=1)
-            current_date = current_date.strftime("%Y-%m-%d")
-            try:
-                portfolio_blob_name = f"portfolio-on-{current_date}.json"
-                logging.info("Fetching for %s", portfolio_blob_name)
-                portfolio = blob_service.get_blob_data_if_exists(portfolio_blob_name)
-                if portfolio:
-                    logging.info("Portfolio found for %s", current_date)
-                    rebalance = strategy.rebalance_portfolio(
-                        portfolio,
-                        current_portfolio,
-                        strategy.build_price_list(nifty200_symbols),
-                    )
-                    logging.info("Rebalancing for %s", current_date)
-                    history[current_date] = {
-                        "capital_incurred": rebalance["capital_incurred"],
-                        "start_date": current_date,
-                        "end_date": end_date,
-                        "num_days": (
-                            datetime.datetime.strptime(end_date, "%Y-%m-%d")
-                            - datetime.datetime.strptime(current_date, "%Y-%m-%d")
-                        ).days,
-                    }
-                else:
-                    logging.error("Portfolio not found for %s | Stopped", current_date)
+        price_list = load_price_list(blob_service, todays_date())
+        past_portfolios = {}
+        manifest = load_date_manifest(blob_service, dated_blob_prefixes())
+        if current_portfolio and price_list:
+            ## The run of portfolios before today without a missing trading day
+            ## is looked up in the date manifest, then downloaded in one wave
+            history_dates = []
+            while True:
+                ## Keep going back in time in YYYY-MM-DD format
+                previous_date = manifest.previous("portfolio-on", current_date)
+                if previous_date is None or (
+                    previous_date < trading_calendar.previous_trading_day(current_date)
+                ):
                     break
-            except Exception as e:
-                logging.error(e)
-                break
-
-        ## valid current_date is one day before
-        current_date = datetime.datetime.strptime(
-            current_date, "%Y-%m-%d"
-        ) + datetime.timedelta(days=1)
-        current_date = current_date.strftime("%Y-%m-%d")
+                current_date = previous_date
+                history_dates.append(current_date)
+            logging.info("Fetching %d past portfolios", len(history_dates))
+            prefetched = blob_service.prefetch_blobs(
+                f"portfolio-on-{date}.json" for date in history_dates
+            )
+            for date in history_dates:
+                portfolio = prefetched.get(f"portfolio-on-{date}.json")
+                if not portfolio:
+                    logging.error("Portfolio not found for %s | Stopped", date)
+                    break
+                past_portfolios[date] = portfolio
+
+        ## Rebalance every past portfolio into today's in one batch
+        try:
+            rebalances = rebalance_many(
+                {**past_portfolios, end_date: current_portfolio},
+                [(date, end_date) for date in past_portfolios],
+                {end_date: price_list},
+            )
+        except Exception as e:
+            logging.error(e)
+            rebalances = {}
+        for (start_date, _), result in rebalances.items():
+            history[start_date] = {
+                "capital_incurred": result["capital_incurred"],
+                "start_date": start_date,
+                "end_date": end_date,
+                "num_days": (
+                    datetime.datetime.strptime(end_date, "%Y-%m-%d")
+                    - datetime.datetime.strptime(start_date, "%Y-%m-%d")
+                ).days,
+            }
+
         ## For all porfolio from current_date till end_date calculate daily returns for each of them and store day wise
+        ## The generate job keeps them in the NAV series, portfolios it does not
+        ## track yet are valued from the stored price lists
         daily_returns = {}
-        while current_date != end_date:
-            ## pick the portfolio for current_date
-            this_date = current_date
-            portfolio_blob_name = f"portfolio-on-{this_date}.json"
-            logging.info("Fetching for %s", portfolio_blob_name)
-            portfolio = blob_service.get_blob_data_if_exists(portfolio_blob_name)
-            while portfolio and this_date != end_date:
-                this_date = datetime.datetime.strptime(
-                    this_date, "%Y-%m-%d"
-                ) + datetime.timedelta(days=1)
-                this_date = this_date.strftime("%Y-%m-%d")
-                if portfolio:
-                    ## for all days from current_date till end_date calculate daily returns
-                    per_change, d1_p, d2_p = get_portfolio_value(
-                        blob_service, portfolio, this_date
-                    )
-                    key = f"{current_date} | {round_off(d2_p)} INR"
-                    if key not in daily_returns:
-                        daily_returns[key] = []
-                    daily_returns[key].append(
-                        {
-                            "per_change": per_change,
-                            "date": this_date,
-                            "current_value": d1_p,
-                        }
-                    )
-            current_date = datetime.datetime.strptime(
-                current_date, "%Y-%m-%d"
-            ) + datetime.timedelta(days=1)
-            current_date = current_date.strftime("%Y-%m-%d")
+        nav = blob_service.get_blob_data_if_exists(nav_blob_name())
+        nav_portfolios = (
+            nav["portfolios"]
+            if nav and nav.get("schema_version") == NAV_SCHEMA_VERSION
+            else {}
+        )
+        untracked = [date for date in past_portfolios if date not in nav_portfolios]
+        if untracked:
+            ## price lists of every day the daily returns below are computed for
+            warm_price_lists(
+                blob_service,
+                manifest.dates(
+                    universes.get_universe().snapshot_prefix, min(untracked), end_date
+                ),
+            )
+        for current_date in sorted(past_portfolios):
+            entry = nav_portfolios.get(current_date)
+            series = [
+                point
+                for point in (entry or {}).get("series", [])
+                if point["date"] <= end_date
+            ]
+            if series:
+                daily_returns[f"{current_date} | {round_off(entry['cost'])} INR"] = [
+                    {
+                        "per_change": point["per_change"],
+                        "date": point["date"],
+                        "current_value": point["value"],
+                    }
+                    for point in series
+                ]
+                continue
+            ## for all days with a snapshot from current_date till end_date
+            ## calculate daily returns
+            portfolio = past_portfolios[current_date]
+            for this_date in manifest.dates(
+                universes.get_universe().snapshot_prefix, current_date, end_date
+            ):
+                if this_date == current_date:
+                    continue
+                value = get_portfolio_value(blob_service, portfolio, this_date)
+                if value is None:
+                    continue
+                per_change, d1_p, d2_p = value
+                key = f"{current_date} | {round_off(d2_p)} INR"
+                if key not in daily_returns:
+                    daily_returns[key] = []
+                daily_returns[key].append(
+                    {
+                        "per_change": per_change,
+                        "date": this_date,
+                        "current_value": d1_p,
+                    }
+                )
 
         logging.info("Daily Returns : %s", json.dumps(daily_returns, indent=2))
 
@@ -540,27 +1265,32 @@ def view_portfolio(
     return None
 
 
+## Load the price lists of several days concurrently into the load_price_list cache
+def warm_price_lists(blob_service: BlobService, request_dates: List):
+    if not request_dates:
+        return
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(8, len(request_dates))
+    ) as executor:
+        list(
+            executor.map(
+                lambda request_date: load_price_list(blob_service, request_date),
+                request_dates,
+            )
+        )
+
+
 def get_portfolio_value(blob_service: BlobService, portfolio, this_date: str):
     logging.info("Getting portfolio change for %s", this_date)
     ## add 1 day to the present date
     this_date = datetime.datetime.strptime(this_date, "%Y-%m-%d")
     this_date = this_date.strftime("%Y-%m-%d")
-    next_day_nifty200_symbols = blob_service.get_blob_data_if_exists(
-        f"all_symbols/nifty200-symbols-{this_date}.json"
-    )
+    price_list = load_price_list(blob_service, this_date)
 
-    if next_day_nifty200_symbols and portfolio:
-        price_list = strategy.build_price_list(next_day_nifty200_symbols)
-        today_value = sum(
-            [stock["shares"] * price_list[stock["symbol"]] for stock in portfolio]
-        )
-        previous_date_value = sum(
-            [stock["shares"] * stock["price"] for stock in portfolio]
-        )
+    if price_list and portfolio:
+        pc, today_value, previous_date_value = portfolio_value(portfolio, price_list)
         logging.info("Today value: %s", today_value)
         logging.info("Previous date value: %s", previous_date_value)
-        ## return percentage change
-        pc = round_off((today_value - previous_date_value) / previous_date_value * 100)
         return pc, today_value, previous_date_value
 
 
@@ -569,68 +1299,146 @@ def get_portfolio_with_params(
     request_date: str = None,
     num_stocks: int = 15,
     investment: int = 500000,
+    universe: str = universes.DEFAULT,
 ) -> List:
-    blob_service = BlobService(azure_blob_account_name)
-    nifty200_symbols = blob_service.get_blob_data_if_exists(
-        f"all_symbols/nifty200-symbols-{request_date}.json"
+    blob_service = get_blob_service(azure_blob_account_name)
+    portfolio = lookup_portfolio(
+        blob_service, request_date, num_stocks, investment, universe
     )
-    if nifty200_symbols:
+    if portfolio is not None:
         tickertape_links = blob_service.get_blob_data_if_exists(
-            f"all_symbols/tickertape-links.json"
-        )
-        return (
-            strategy.build_portfolio(
-                nifty200_symbols, N=num_stocks, investment=investment
-            ),
-            tickertape_links,
+            universes.get_universe(universe).all_symbols_blob_name(
+                "tickertape-links.json"
+            )
         )
+        return portfolio, tickertape_links
     return None
 
 
+## Composite scores and top N of a day for a batch of weightings, in one pass
+## weightings: list of {"blend": [returns, vwap, rsi], "horizon": [1y, 1mo, 1w]},
+## a missing key uses the default weights
+def score_weightings(
+    azure_blob_account_name: str,
+    request_date: str,
+    weightings: List[Dict],
+    top_n: int = 15,
+    universe: str = universes.DEFAULT,
+) -> List[Dict]:
+    blend_weights = []
+    horizon_weights = []
+    for weighting in weightings:
+        blend = weighting.get("blend", scoring.BLEND_WEIGHTS)
+        horizon = weighting.get("horizon", scoring.HORIZON_WEIGHTS)
+        if len(blend) != len(scoring.FACTORS) or len(horizon) != len(scoring.HORIZONS):
+            raise ValueError(f"Invalid weighting {weighting}")
+        blend_weights.append([float(w) for w in blend])
+        horizon_weights.append([float(w) for w in horizon])
+
+    blob_service = get_blob_service(azure_blob_account_name)
+    factor_matrix = load_factor_matrix(blob_service, request_date, universe)
+    if factor_matrix is None or not weightings:
+        return None
+    scores = factor_matrix.scores(blend_weights, horizon_weights)
+    top = factor_matrix.top_n(scores, top_n)
+    return [
+        {
+            "blend": blend_weights[k],
+            "horizon": horizon_weights[k],
+            "top": [
+                {
+                    "symbol": str(factor_matrix.symbols[i]),
+                    "composite_score": float(scores[i, k]),
+                }
+                for i in top[k]
+            ],
+        }
+        for k in range(len(weightings))
+    ]
+
+
 def get_rebalance_with_params(
     azure_blob_account_name: str,
     from_date: str,
     to_date: str,
     num_stocks: int = 15,
     investment: int = 500000,
+    universe: str = universes.DEFAULT,
 ) -> Dict:
-    blob_service = BlobService(azure_blob_account_name)
+    blob_service = get_blob_service(azure_blob_account_name)
 
-    nifty200_symbols_from_date = blob_service.get_blob_data_if_exists(
-        f"all_symbols/nifty200-symbols-{from_date}.json"
+    from_portfolio = lookup_portfolio(
+        blob_service, from_date, num_stocks, investment, universe
     )
-    nifty200_symbols_to_date = blob_service.get_blob_data_if_exists(
-        f"all_symbols/nifty200-symbols-{to_date}.json"
+    to_portfolio = lookup_portfolio(
+        blob_service, to_date, num_stocks, investment, universe
     )
-    if nifty200_symbols_from_date and nifty200_symbols_to_date:
-        from_portfolio = strategy.build_portfolio(
-            nifty200_symbols_from_date, N=num_stocks, investment=investment
-        )
-        to_portfolio = strategy.build_portfolio(
-            nifty200_symbols_to_date, N=num_stocks, investment=investment
-        )
+    if from_portfolio and to_portfolio:
         return strategy.rebalance_portfolio(
             from_portfolio,
             to_portfolio,
-            strategy.build_price_list(nifty200_symbols_to_date),
+            load_price_list(blob_service, to_date, universe),
         )
     return None
 
 
+## Rebalances of many (from_date, to_date) pairs of the same parameters at once
+def get_rebalances_with_params(
+    azure_blob_account_name: str,
+    pairs: List,
+    num_stocks: int = 15,
+    investment: int = 500000,
+    universe: str = universes.DEFAULT,
+) -> List[Dict]:
+    blob_service = get_blob_service(azure_blob_account_name)
+    dates = {date for pair in pairs for date in pair}
+    portfolios = {
+        date: lookup_portfolio(blob_service, date, num_stocks, investment, universe)
+        for date in sorted(dates)
+    }
+    price_lists = {
+        to_date: load_price_list(blob_service, to_date, universe)
+        for _, to_date in pairs
+    }
+    ## pairs missing a portfolio or a price list come back as None
+    valid = [
+        (from_date, to_date)
+        for from_date, to_date in pairs
+        if portfolios[from_date] and portfolios[to_date] and price_lists[to_date]
+    ]
+    rebalances = rebalance_many(
+        {date: portfolio for date, portfolio in portfolios.items() if portfolio},
+        valid,
+        price_lists,
+    )
+    return [
+        (
+            dict(rebalances[pair], from_date=pair[0], to_date=pair[1])
+            if pair in rebalances
+            else None
+        )
+        for pair in map(tuple, pairs)
+    ]
+
+
 def build_score_card(azure_blob_account_name: str) -> Dict:
     container_name = "nifty-scorecards"
-    blob_service = BlobService(azure_blob_account_name, container_name)
+    blob_service = get_blob_service(azure_blob_account_name, container_name)
     blob_name = strategy.get_file_name("nifty200-scorecard")
     score_card = blob_service.get_blob_data_if_exists(blob_name)
     if score_card is None:
         logging.info("%s blob does not exist", blob_name)
-        score_card = scorecard.getStockList()
+        ## constituent lists live with the snapshots, not the scorecards
+        score_card = scorecard.getStockList(
+            blob_service=get_blob_service(azure_blob_account_name)
+        )
         blob_service.upload_blob(score_card, blob_name)
     return score_card
 
+
 def build_stock_news(azure_blob_account_name: str) -> Dict:
     container_name = "stock-news"
-    blob_service = BlobService(azure_blob_account_name, container_name)
+    blob_service = get_blob_service(azure_blob_account_name, container_name)
     blob_name = strategy.get_file_name("stock-news")
     stock_news = blob_service.get_blob_data_if_exists(blob_name)
     if stock_news is None:
@@ -642,7 +1450,7 @@ def build_stock_news(azure_blob_account_name: str) -> Dict:
 
 def get_score_card(azure_blob_account_name: str, request_date: str = None) -> Dict:
     container_name = "nifty-scorecards"
-    blob_service = BlobService(azure_blob_account_name, container_name)
+    blob_service = get_blob_service(azure_blob_account_name, container_name)
     if request_date:
         blob_name = f"nifty200-scorecard-{request_date}.json"
     else:
@@ -653,9 +1461,10 @@ def get_score_card(azure_blob_account_name: str, request_date: str = None) -> Di
         return scorecard
     return None
 
+
 def get_stock_news(azure_blob_account_name: str, request_date: str = None) -> Dict:
     container_name = "stock-news"
-    blob_service = BlobService(azure_blob_account_name, container_name)
+    blob_service = get_blob_service(azure_blob_account_name, container_name)
     if request_date:
         blob_name = f"stock-news-{request_date}.json"
     else:
@@ -664,4 +1473,4 @@ def get_stock_news(azure_blob_account_name: str, request_date: str = None) -> Di
     stock_news = blob_service.get_blob_data_if_exists(blob_name)
     if stock_news:
         return stock_news
-    return None
\ No newline at end of file
+    return None
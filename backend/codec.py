@@ -0,0 +1,180 @@
+"""
+Storage encoding of JSON blobs.
+
+Blobs are written as compact JSON (no indentation, orjson when it is
+installed) compressed with zstd, or gzip when zstandard is not installed,
+and the compression is recorded as the blob's `Content-Encoding`. Readers
+do not rely on that metadata: `decode` sniffs the gzip / zstd magic bytes
+and reads anything else as plain JSON, so blobs written before compression,
+and payloads an HTTP client already decompressed, decode the same way.
+
+`BLOB_ENCODING` (env) picks the compression of new blobs: `zstd`, `gzip`
+or `identity` for uncompressed JSON.
+
+Cached results in Redis go through a `Serializer` instead: a format (`json`,
+or `msgpack` when it is installed) and a compression (`zstd`, `lz4`, `gzip`
+or none) named like `msgpack+lz4`. Its `tag` goes into the cache keys, so
+entries written with another serializer are never misread.
+"""
+
+import functools
+import gzip
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+## Read from the environment variable
+BLOB_ENCODING = os.getenv("BLOB_ENCODING", "zstd" if zstandard else "gzip")
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", 3))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+LZ4_MAGIC = b"\x04\x22\x4d\x18"
+CONTENT_TYPE = "application/json"
+
+
+def dumps(obj) -> bytes:
+    """Compact JSON bytes of an object."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            ## e.g. non-str dict keys, which the stdlib encoder converts
+            pass
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    """Object of JSON bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def compress(data: bytes, encoding: str = BLOB_ENCODING) -> bytes:
+    """Compress bytes with a content encoding, `identity` leaves them as is."""
+    if encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd encoding needs the zstandard package")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == "gzip":
+        ## mtime=0 keeps the bytes of the same payload identical
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "lz4":
+        if lz4_frame is None:
+            raise ValueError("lz4 encoding needs the lz4 package")
+        return lz4_frame.compress(data)
+    if encoding == "identity":
+        return data
+    raise ValueError(f"Unknown blob encoding {encoding}")
+
+
+def decompress(data: bytes) -> bytes:
+    """Decompress gzip, zstd or lz4 bytes by their magic bytes, others are returned as is."""
+    if data[:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("zstd compressed blob, needs the zstandard package")
+        ## frames written by compress() carry their content size
+        return zstandard.ZstdDecompressor().decompress(data)
+    if data[:4] == LZ4_MAGIC:
+        if lz4_frame is None:
+            raise ValueError("lz4 compressed payload, needs the lz4 package")
+        return lz4_frame.decompress(data)
+    return data
+
+
+def encode(obj, encoding: str = BLOB_ENCODING):
+    """Blob bytes of an object.
+    @return (data, content_encoding), content_encoding is None for identity
+    """
+    data = compress(dumps(obj), encoding)
+    return data, None if encoding == "identity" else encoding
+
+
+def decode(data: bytes):
+    """Object of blob bytes, compressed or plain JSON."""
+    return loads(decompress(data))
+
+
+SERIALIZER_VERSION = 1
+
+
+class Serializer:
+    """Bytes of cached results: a format and a compression, e.g. `msgpack+lz4`."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.format, _, compression = name.partition("+")
+        self.compression = compression or "identity"
+        if self.format == "json":
+            self._dumps, self._loads = dumps, loads
+        elif self.format == "msgpack":
+            if msgpack is None:
+                raise ValueError("msgpack format needs the msgpack package")
+            self._dumps = msgpack.packb
+            self._loads = functools.partial(msgpack.unpackb, strict_map_key=False)
+        else:
+            raise ValueError(f"Unknown serializer format {self.format}")
+        ## fail at startup, not on the first cached call
+        compress(b"", self.compression)
+
+    @property
+    def tag(self) -> str:
+        """Key prefix of the payloads written by this serializer."""
+        return f"{self.name}.v{SERIALIZER_VERSION}"
+
+    def dumps(self, obj) -> bytes:
+        return compress(self._dumps(obj), self.compression)
+
+    def loads(self, data: bytes):
+        if self.compression != "identity":
+            data = decompress(data)
+        return self._loads(data)
+
+    def __repr__(self):
+        return f"Serializer({self.name!r})"
+
+
+def available_serializers():
+    """Names of the serializers the installed packages support."""
+    data_formats = ["json"] + (["msgpack"] if msgpack is not None else [])
+    compressions = ["", "gzip"]
+    compressions += ["zstd"] if zstandard is not None else []
+    compressions += ["lz4"] if lz4_frame is not None else []
+    return [
+        f"{data_format}+{compression}" if compression else data_format
+        for data_format in data_formats
+        for compression in compressions
+    ]
+
+
+def default_serializer() -> str:
+    """Fastest installed format with the fastest installed compression."""
+    data_format = "msgpack" if msgpack is not None else "json"
+    if lz4_frame is not None:
+        return f"{data_format}+lz4"
+    if zstandard is not None:
+        return f"{data_format}+zstd"
+    return data_format
@@ -0,0 +1,186 @@
+"""
+Cached index constituent list.
+
+The constituents page of an index changes a couple of times a year, so the
+parsed list (symbol, name, ticker id, tickertape link) is kept as a small
+versioned JSON blob per index URL (`constituents/` in the strategy
+container), next to the snapshots built from it. Every run revalidates it with
+`If-None-Match` / `If-Modified-Since`; a 304, or a 200 whose body hashes the
+same as before, reuses the stored list without parsing. A changed page is
+parsed with lxml when it is installed, restricted to the constituent rows by
+a SoupStrainer, and a membership change bumps the version and is logged.
+Without a blob service nothing is kept and every run parses the page.
+
+Reading, parsing and writing the artifact block, so coroutines run them in the
+default executor instead of on the shared fetcher event loop.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import logging
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from fetcher import get_fetcher
+
+logging = logging.getLogger(__name__)
+
+try:
+    import lxml  # pylint: disable=unused-import
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+SCHEMA_VERSION = 1
+NIFTY_200_URL = "https://www.tickertape.in/indices/nifty-200-index-.NIFTY200/constituents?type=marketcap"
+TICKERTAPE_URL = "https://www.tickertape.in"
+
+
+def parse_constituents(content):
+    """Constituent rows of a tickertape index page, in page order."""
+    rows = SoupStrainer("tr", attrs={"class": "constituent-data-row"})
+    soup = BeautifulSoup(content, features=HTML_PARSER, parse_only=rows)
+    constituents = []
+    for row in soup.find_all("tr", {"class": "constituent-data-row"}):
+        aTag = row.find("a", href=True)
+        sTag = row.find("span", {"class": "typography-caption-medium"})
+        if aTag is None or sTag is None:
+            continue
+        constituents.append(
+            {
+                "symbol": sTag.text,
+                "name": aTag.text,
+                "ticker": aTag["href"].split("-")[-1],
+                "link": f"{TICKERTAPE_URL}{aTag['href']}",
+            }
+        )
+    return constituents
+
+
+def _header(headers, name):
+    """Case-insensitive header lookup, responses carry plain dicts."""
+    name = name.lower()
+    return next((v for k, v in (headers or {}).items() if k.lower() == name), None)
+
+
+def blob_name(url):
+    """Blob of the artifact of an index page."""
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return f"constituents/constituents-{key}.json"
+
+
+class ConstituentList:
+    """Stored artifact of one index page.
+    @param blob_service: BlobService of the strategy container, None keeps
+    the artifact in memory only
+    """
+
+    def __init__(self, url, blob_service=None):
+        self.url = url
+        self.blob_service = blob_service
+        self.blob_name = blob_name(url)
+        self.artifact = self._load()
+
+    def _load(self):
+        if self.blob_service is None:
+            return None
+        try:
+            ## uncached read, the artifact is updated in place
+            artifact, _ = self.blob_service.get_blob_data_with_etag(self.blob_name)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning("Failed to read %s: %s", self.blob_name, e)
+            return None
+        if not artifact or artifact.get("schema_version") != SCHEMA_VERSION:
+            return None
+        return artifact
+
+    def _save(self):
+        if self.blob_service is not None:
+            self.blob_service.upload_blob(self.artifact, self.blob_name)
+
+    @property
+    def constituents(self):
+        return self.artifact["constituents"] if self.artifact else None
+
+    def conditional_headers(self):
+        headers = {}
+        if self.artifact and self.artifact.get("etag"):
+            headers["If-None-Match"] = self.artifact["etag"]
+        if self.artifact and self.artifact.get("last_modified"):
+            headers["If-Modified-Since"] = self.artifact["last_modified"]
+        return headers
+
+    def update(self, response):
+        """Apply a response to the conditional request.
+        @return True if the membership changed"""
+        now = datetime.datetime.now().isoformat()
+        if response.status_code == 304 and self.artifact:
+            self.artifact["checked_at"] = now
+            self._save()
+            return False
+        if not response.ok:
+            raise ValueError(f"{self.url}: status {response.status_code}")
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        previous = self.artifact or {}
+        if previous.get("sha256") == digest:
+            constituents = previous["constituents"]
+        else:
+            constituents = parse_constituents(response.content)
+            if not constituents:
+                raise ValueError(f"{self.url}: no constituents found")
+
+        old_symbols = {c["symbol"] for c in previous.get("constituents", [])}
+        new_symbols = {c["symbol"] for c in constituents}
+        changed = old_symbols != new_symbols
+        self.artifact = {
+            "schema_version": SCHEMA_VERSION,
+            "version": previous.get("version", 0) + int(changed),
+            "url": self.url,
+            "etag": _header(response.headers, "ETag"),
+            "last_modified": _header(response.headers, "Last-Modified"),
+            "sha256": digest,
+            "checked_at": now,
+            "updated_at": now if changed else previous.get("updated_at", now),
+            "constituents": constituents,
+        }
+        self._save()
+        if changed and previous:
+            logging.info(
+                "constituents of %s changed, added %s removed %s",
+                self.url,
+                sorted(new_symbols - old_symbols),
+                sorted(old_symbols - new_symbols),
+            )
+        return changed
+
+
+async def fetch_constituents(url=NIFTY_200_URL, fetch=None, blob_service=None):
+    """Coroutine: revalidate and return the constituent list of `url`.
+    @param fetch: coroutine function (url, headers) -> FetchResponse, the shared
+    fetcher by default
+    @param blob_service: BlobService the artifact is kept in
+    @return ConstituentList, whose `constituents` is None if nothing could be loaded
+    """
+    if fetch is None:
+        fetch = get_fetcher().fetch
+    loop = asyncio.get_running_loop()
+    constituent_list = await loop.run_in_executor(
+        None, ConstituentList, url, blob_service
+    )
+    try:
+        response = await fetch(url, headers=constituent_list.conditional_headers())
+        await loop.run_in_executor(None, constituent_list.update, response)
+    except Exception as e:  # pylint: disable=broad-except
+        ## a stale list is better than none when the page is unavailable
+        logging.error("Failed to revalidate constituents of %s: %s", url, e)
+    return constituent_list
+
+
+def get_constituents(url=NIFTY_200_URL, fetch=None, blob_service=None):
+    """Blocking `fetch_constituents` on the shared event loop."""
+    return get_fetcher().run(
+        fetch_constituents(url, fetch=fetch, blob_service=blob_service)
+    )
@@ -0,0 +1,191 @@
+"""
+Shared asyncio HTTP fetch layer used by the scrapers.
+
+A single event loop runs on a background thread and owns one aiohttp session,
+so every module in the process shares the same keep-alive connection pools.
+Concurrency is bounded per host, which keeps the number of open sockets small
+even when a generate run issues ~1000 requests. Each host is also paced by an
+adaptive rate limiter and circuit breaker, see `ratelimit`.
+"""
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from ratelimit import HostGuard, RetryBudget
+
+logging = logging.getLogger(__name__)
+
+## Read from the environment variable
+FETCH_LIMIT_PER_HOST = int(os.getenv("FETCH_LIMIT_PER_HOST", 16))
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", 15))
+KEEPALIVE_TIMEOUT = 30
+
+
+class FetchError(Exception):
+    """Raised when a request could not be completed."""
+
+
+class CircuitOpenError(FetchError):
+    """Raised without calling a host whose circuit breaker is open."""
+
+
+class FetchResponse:
+    """Fully read HTTP response, mirrors the parts of `requests.Response` we use."""
+
+    __slots__ = ("url", "status_code", "headers", "content", "elapsed")
+
+    def __init__(self, url, status_code, headers, content, elapsed):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpFetcher:
+    """Runs all requests of the process on one event loop with pooled connections."""
+
+    def __init__(self, limit_per_host=FETCH_LIMIT_PER_HOST, timeout=FETCH_TIMEOUT):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._session = None
+        self._semaphores = {}
+        self._guards = {}
+        ## one retry budget for every caller in the process, see `start_run`
+        self.retry_budget = RetryBudget()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="http-fetcher", daemon=True
+        )
+        self._thread.start()
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit_per_host)
+            self._semaphores[host] = semaphore
+        return semaphore
+
+    def _host_guard(self, url):
+        host = urlsplit(url).netloc
+        guard = self._guards.get(host)
+        if guard is None:
+            guard = HostGuard(host)
+            self._guards[host] = guard
+        return guard
+
+    async def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def fetch(self, url, headers=None, cookies=None):
+        """Coroutine: GET `url` and return a `FetchResponse`.
+        Raises FetchError on transport failures; HTTP errors are returned as is."""
+        session = await self._get_session()
+        guard = self._host_guard(url)
+        async with self._host_semaphore(url):
+            if not await guard.acquire():
+                raise CircuitOpenError(f"{url}: circuit open for {guard.host}")
+            start = time.perf_counter()
+            try:
+                async with session.get(
+                    url, headers=headers, cookies=cookies
+                ) as response:
+                    content = await response.read()
+                    elapsed = time.perf_counter() - start
+                    guard.on_response(response.status, response.headers, elapsed)
+                    return FetchResponse(
+                        url, response.status, dict(response.headers), content, elapsed
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                guard.on_error()
+                raise FetchError(f"{url}: {e!r}") from e
+            except BaseException:
+                ## e.g. CancelledError, a half-open probe must still end
+                guard.on_abort()
+                raise
+
+    def start_run(self, retry_budget=None):
+        """Reset the shared retry budget at the start of a run.
+        The reset runs on the loop thread like every other budget update, and
+        before the coroutines this thread submits after it."""
+        self._loop.call_soon_threadsafe(self.retry_budget.reset, retry_budget)
+
+    def stats(self):
+        """Per host counters (requests, throttled, failed, rejected), rate and circuit state."""
+        stats = {host: guard.stats() for host, guard in self._guards.items()}
+        stats["retries"] = {
+            "spent": self.retry_budget.spent,
+            "denied": self.retry_budget.denied,
+            "budget": self.retry_budget.budget,
+        }
+        return stats
+
+    def run(self, coro):
+        """Run a coroutine on the shared loop and block until it finishes."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def get(self, url, headers=None, cookies=None):
+        """Blocking GET on the shared loop."""
+        return self.run(self.fetch(url, headers=headers, cookies=cookies))
+
+    def get_many(self, urls, headers=None, cookies=None):
+        """Blocking concurrent GET of all `urls`, results are in input order.
+        A failed request yields its FetchError instead of a response."""
+
+        async def _gather():
+            return await asyncio.gather(
+                *[self.fetch(url, headers=headers, cookies=cookies) for url in urls],
+                return_exceptions=True,
+            )
+
+        return self.run(_gather())
+
+    def close(self):
+        if self._session is not None:
+            self.run(self._session.close())
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    """Process-wide fetcher, created on first use."""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = HttpFetcher()
+            atexit.register(_fetcher.close)
+        return _fetcher
@@ -35,6 +35,22 @@ def momentum_strategy(myTimer: func.TimerRequest) -> None:
     logging.info("Executed momentum strategy successfully!")
 
 
+## Refresh the 1w horizon of today's stocks every 30 minutes of market hours (UTC)
+@app.schedule(
+    schedule="*/30 4-9 * * 1-5",
+    arg_name="myTimer",
+    run_on_startup=False,
+    use_monitor=False,
+)
+def intraday_refresh(myTimer: func.TimerRequest) -> None:
+    if myTimer.past_due:
+        logging.info("The timer is past due!")
+
+    connection_string = os.environ["AzureWebJobsStorage"]
+    business.refresh_todays_universe(connection_string)
+    logging.info("Executed intraday refresh successfully!")
+
+
 @app.route(route="portfolio", auth_level=func.AuthLevel.FUNCTION)
 def portfolio(req: func.HttpRequest) -> func.HttpResponse:
     request_date = req.params.get("date")
@@ -1,20 +1,33 @@
 ## Author: Prashant Srivastava
 
+import argparse
 import json
 import logging
+import math
+import os
 import sys
 import pathlib
 import datetime
-import concurrent.futures
+import asyncio
+import time
 from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
+    retry_all,
     retry_if_exception_type,
+    retry_if_not_exception_type,
 )
 
-import requests
-from bs4 import BeautifulSoup
+
+import constituents
+import http_cache
+import indicators
+import scoring
+import snapshot
+import trading_calendar
+from fetcher import CircuitOpenError, FetchError, get_fetcher
+from rebalance import Holdings
 
 
 logging.basicConfig(
@@ -25,6 +38,22 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)],
 )
 
+DURATIONS = ["1y", "1mo", "1w"]
+RSI_PERIOD = 14
+## attempts of one chart series fetch, the first one included
+FETCH_ATTEMPTS = 4
+## Opt-in: fetch only the 1y series and derive the 1mo/1w indicators from it
+SINGLE_FETCH = os.getenv("TICKERTAPE_SINGLE_FETCH", "0") == "1"
+## NSE cash market session
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+MARKET_OPEN = datetime.time(9, 15)
+MARKET_CLOSE = datetime.time(15, 30)
+## Calendar window, and trading-day fallback when points carry no timestamp
+HORIZON_WINDOWS = {"1mo": (30, 21), "1w": (7, 5)}
+## RSI state is resumed only where the window is much longer than RSI_PERIOD,
+## the seed of a rolling 1mo or 1w window moves every day and has to be replayed
+RSI_RESUME_DURATIONS = ("1y",)
+
 
 class TickerRequest:
     def __init__(self):
@@ -35,12 +64,25 @@ class TickerRequest:
             with open("cred.json", "r") as fh:
                 creds = json.load(fh)
                 self.cookies = creds["cookies"]
-                self.header = creds["headers"]
+                self.headers = creds["headers"]
         except:
             logging.info("credentials not found using public login")
+        self.fetcher = get_fetcher()
+        ## telemetry.RunReport of the current run, if one is collected
+        self.report = None
+
+    ## @brief Coroutine to fetch a page on the shared event loop
+    ## served from the record/replay cache when it is enabled
+    async def fetch(self, page, headers=None):
+        return await http_cache.get_cache().fetch(
+            self.fetcher,
+            page,
+            cookies=self.cookies,
+            headers=dict(self.headers, **(headers or {})),
+        )
 
     def get(self, page):
-        return requests.get(page, cookies=self.cookies, headers=self.headers)
+        return self.fetcher.run(self.fetch(page))
 
 
 ## @brief Method to calculate RSI
@@ -140,7 +182,7 @@ def _raw_components(returns, price):
     3. RSI: tent function (rewards 50-65, penalizes >75)
     4. Time weights: 1w reduced from 0.50 to 0.25
     """
-    time_weights = [0.35, 0.40, 0.25]  # 1y, 1mo, 1w
+    time_weights = scoring.HORIZON_WEIGHTS  # 1y, 1mo, 1w
 
     raw_returns = [
         returns["1y"]["return"],
@@ -168,56 +210,9 @@ def _raw_components(returns, price):
 
 def compute_composite_scores(results):
     """Cross-sectional z-score normalization across the universe,
-    then blend with 0.4/0.3/0.3 weights so the labels mean what they say."""
-    weight_returns = 0.4
-    weight_vwap = 0.3
-    weight_rsi = 0.3
-
-    # Phase 1: compute raw components for each stock
-    components = []
-    for s in results:
-        try:
-            r, v, rs, raw_ret, raw_vwap, raw_rsi = _raw_components(
-                s["returns"], s["price"]
-            )
-            components.append((r, v, rs))
-            s["_raw"] = (r, v, rs)
-            s["normalized_returns"] = raw_ret
-            s["normalized_vwap"] = raw_vwap
-            s["normalized_rsi"] = raw_rsi
-        except Exception:
-            components.append(None)
-            s["_raw"] = None
-
-    # Phase 2: z-score normalize across the universe
-    valid = [c for c in components if c is not None]
-    if not valid:
-        for s in results:
-            s["composite_score"] = 0
-        return
-
-    r_vals = [c[0] for c in valid]
-    v_vals = [c[1] for c in valid]
-    s_vals = [c[2] for c in valid]
-
-    def _stats(vals):
-        m = sum(vals) / len(vals)
-        sd = (sum((x - m) ** 2 for x in vals) / len(vals)) ** 0.5
-        return m, sd if sd > 0 else 1.0
-
-    mr, sdr = _stats(r_vals)
-    mv, sdv = _stats(v_vals)
-    ms, sds = _stats(s_vals)
-
-    for s in results:
-        raw = s.pop("_raw", None)
-        if raw is None:
-            s["composite_score"] = 0
-            continue
-        zr = (raw[0] - mr) / sdr
-        zv = (raw[1] - mv) / sdv
-        zs = (raw[2] - ms) / sds
-        s["composite_score"] = weight_returns * zr + weight_vwap * zv + weight_rsi * zs
+    then blend with scoring.BLEND_WEIGHTS so the labels mean what they say.
+    Vectorised over the universe, see `scoring`."""
+    scoring.score(results)
 
 
 def composite_score(returns, price):
@@ -225,18 +220,124 @@ def composite_score(returns, price):
     Applies bug fixes but without cross-sectional z-score normalization."""
     r, v, rs, raw_ret, raw_vwap, raw_rsi = _raw_components(returns, price)
 
-    weight_returns = 0.4
-    weight_vwap = 0.3
-    weight_rsi = 0.3
+    weight_returns, weight_vwap, weight_rsi = scoring.BLEND_WEIGHTS
 
     score = weight_returns * r + weight_vwap * v + weight_rsi * rs
     return score, raw_ret, raw_vwap, raw_rsi
 
 
-## @brief Method to fetch nifty 200 data
-## @return result: nifty 200 data
-def fetch_nifty_200_data():
-    apiTicker = ".NIFTY200"
+def _parse_ts(ts):
+    return datetime.datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+
+## @brief Method to slice the trailing window of a longer series
+## @param data_points: list of data points, oldest first
+## @param duration: 1mo or 1w
+## @return window: data points of the window, starting at the last close before it
+def horizon_window(data_points, duration):
+    days, fallback_points = HORIZON_WINDOWS[duration]
+    if "ts" in data_points[-1]:
+        start = _parse_ts(data_points[-1]["ts"]) - datetime.timedelta(days=days)
+        base = 0
+        for i, point in enumerate(data_points):
+            if _parse_ts(point["ts"]) > start:
+                break
+            base = i
+    else:
+        base = max(len(data_points) - fallback_points - 1, 0)
+    return data_points[base:]
+
+
+## @brief Method to build the indicator inputs of all horizons from a 1y series
+## @param data_points: 1y list of data points
+## @param period_return: 1y return reported by the api
+## @param period: RSI period
+## @return inputs: (return, vwap data points, rsi data points) keyed by duration
+def horizon_inputs(data_points, period_return, period=RSI_PERIOD):
+    inputs = {"1y": (period_return, data_points, data_points)}
+    for duration in HORIZON_WINDOWS:
+        window = horizon_window(data_points, duration)
+        inputs[duration] = (
+            (window[-1]["lp"] / window[0]["lp"] - 1) * 100.0,
+            window,
+            ## daily points of a short window are too few for RSI, so seed it
+            ## with enough trailing points of the longer series
+            data_points[-max(len(window), period + 1) :],
+        )
+    return inputs
+
+
+## @brief Method to derive all horizons from a single 1y series
+## @param data_points: 1y list of data points
+## @param period_return: 1y return reported by the api
+## @param period: RSI period
+## @return returns: return, vwap and rsi keyed by duration
+def derive_horizons(data_points, period_return, period=RSI_PERIOD):
+    return {
+        duration: {
+            "return": horizon_return,
+            "vwap": calculate_vwap(vwap_points),
+            "rsi": calculate_rsi(rsi_points, period),
+        }
+        for duration, (horizon_return, vwap_points, rsi_points) in horizon_inputs(
+            data_points, period_return, period
+        ).items()
+    }
+
+
+## @brief Method to calculate return, vwap and rsi of many series in one batch
+## @param inputs: list of (return, vwap data points, rsi data points)
+## @param period: RSI period
+## @param states: saved RSI smoothing state per input or None, updated in place
+## @return results: return, vwap and rsi per input, None where undefined
+def compute_indicators(inputs, period=RSI_PERIOD, states=None):
+    if not inputs:
+        return []
+    if states is None:
+        states = [None] * len(inputs)
+    (prices, volumes), lengths = indicators.pad_points([x[1] for x in inputs])
+    vwaps = indicators.batch_vwap(prices, volumes, lengths).tolist()
+
+    ## resume RSI from saved state where possible, replay the rest in one batch
+    rsis = [None] * len(inputs)
+    replay = []
+    for i, (x, state) in enumerate(zip(inputs, states)):
+        resumed = indicators.update_rsi(state, x[2], period) if state else None
+        if resumed is None:
+            replay.append(i)
+        else:
+            rsis[i], states[i] = resumed
+    if replay:
+        (prices,), lengths = indicators.pad_points(
+            [inputs[i][2] for i in replay], ("lp",)
+        )
+        rsi, avg_gain, avg_loss = indicators.batch_rsi(
+            prices, lengths, period, return_state=True
+        )
+        for i, r, gain, loss in zip(
+            replay, rsi.tolist(), avg_gain.tolist(), avg_loss.tolist()
+        ):
+            rsis[i] = r
+            states[i] = (
+                None
+                if math.isnan(r)
+                else indicators.rsi_state(gain, loss, inputs[i][2][-1], period)
+            )
+    logging.info(f"RSI resumed for {len(inputs) - len(replay)}/{len(inputs)} series")
+
+    results = []
+    for (period_return, _, _), vwap, rsi in zip(inputs, vwaps, rsis):
+        if math.isnan(vwap) or math.isnan(rsi):
+            results.append(None)
+        else:
+            results.append({"return": period_return, "vwap": vwap, "rsi": rsi})
+    return results
+
+
+## @brief Method to fetch the latest data of an index
+## @param apiTicker: tickertape id of the index
+## @return result: rsi and current price of the index
+def fetch_index_data(apiTicker=".NIFTY200"):
     base_api_url = f"https://api.tickertape.in/stocks/charts/inter/{apiTicker}"
     tickerRequest = TickerRequest()
     result = {}
@@ -259,107 +360,509 @@ def fetch_nifty_200_data():
     return None
 
 
-## @brief Method to get list of stocks from tickertape
-## @param baseUrl: base url to fetch list of stocks
-## @return results: list of stocks
-def getStockList(
-    baseUrl="https://www.tickertape.in/indices/nifty-200-index-.NIFTY200/constituents?type=marketcap",
+## @brief Method to fetch nifty 200 data
+## @return result: nifty 200 data
+def fetch_nifty_200_data():
+    return fetch_index_data(".NIFTY200")
+
+
+def _log_retry(retry_state):
+    symbol, duration = retry_state.args[3], retry_state.args[2]
+    logging.info(
+        f"Retrying {symbol} {duration} after {retry_state.outcome.exception()} - "
+        f"Attempt {retry_state.attempt_number}"
+    )
+
+
+## Every retry of the run draws from the fetcher's shared retry budget; tenacity
+## asks before its stop check, so the last attempt must not spend a unit
+def _within_retry_budget(retry_state):
+    if retry_state.attempt_number >= FETCH_ATTEMPTS:
+        return False
+    return retry_state.args[0].fetcher.retry_budget.try_spend()
+
+
+## @brief Coroutine to fetch one chart series of a stock, with retries
+## @param tickerRequest: TickerRequest to fetch with
+## @param apiTicker: tickertape id of the stock
+## @param duration: duration of the series
+## @param symbol: stock symbol, for logging
+## @return period_return, data_points: api return and data points of the series
+@retry(
+    stop=stop_after_attempt(FETCH_ATTEMPTS),
+    wait=wait_exponential(
+        multiplier=1, min=1, max=10
+    ),  # Wait 1, 2, 4, 8 seconds between retries
+    retry=retry_all(
+        retry_if_exception_type((FetchError, ValueError)),
+        ## an open circuit fails fast, retrying it would only spend the budget
+        retry_if_not_exception_type(CircuitOpenError),
+        _within_retry_budget,
+    ),
+    before_sleep=_log_retry,
+)
+async def fetch_duration_data(tickerRequest, apiTicker, duration, symbol):
+    apiUrl = (
+        f"https://api.tickertape.in/stocks/charts/inter/{apiTicker}?duration={duration}"
+    )
+    logging.info(f"Fetching data for {symbol} last {duration}")
+
+    start = time.perf_counter()
+    res = None
+    try:
+        res = await tickerRequest.fetch(apiUrl)
+        if not res.ok:
+            raise FetchError(f"Failed with status {res.status_code}")
+
+        res_json = res.json()
+        data_points = res_json["data"][0]["points"]
+        if len(data_points) < RSI_PERIOD + 1:
+            raise ValueError("Insufficient data points to calculate RSI.")
+    except Exception as e:
+        if tickerRequest.report is not None:
+            tickerRequest.report.attempt(
+                symbol, duration, time.perf_counter() - start, res, error=e
+            )
+        raise
+    if tickerRequest.report is not None:
+        tickerRequest.report.attempt(symbol, duration, time.perf_counter() - start, res)
+
+    return res_json["data"][0]["r"], data_points
+
+
+## @brief Coroutine to fetch several chart series of a stock concurrently
+## @return series: (period_return, data_points) keyed by the durations that succeeded
+async def fetch_durations(tickerRequest, apiTicker, durations, symbol):
+    outcomes = await asyncio.gather(
+        *[
+            fetch_duration_data(tickerRequest, apiTicker, duration, symbol)
+            for duration in durations
+        ],
+        return_exceptions=True,
+    )
+    series = {}
+    for duration, outcome in zip(durations, outcomes):
+        if isinstance(outcome, Exception):
+            logging.error(
+                f"Failed to get data for {symbol} {duration} after all retries: {outcome}"
+            )
+            continue
+        series[duration] = outcome
+    return series
+
+
+## @brief Method to fetch the chart series of index members and compute their indicators
+## @param tickerRequest: TickerRequest to fetch with
+## @param members: constituents to fetch, each symbol once
+## @param single_fetch: fetch only 1y per stock and derive the other horizons
+## @param validation: if a dict, collect fetched vs derived horizons per symbol
+## @param rsi_state: if a dict, RSI state of the previous run, updated in place
+## @param report: if a telemetry.RunReport, filled with per-symbol fetch telemetry
+## @return results: list of unscored stocks, in the order their fetches completed
+def fetch_stock_records(
+    tickerRequest,
+    members,
+    single_fetch=SINGLE_FETCH,
+    validation=None,
+    rsi_state=None,
+    report=None,
 ):
-    tickerRequest = TickerRequest()
-    res = tickerRequest.get(baseUrl)
     results = []
-    retries = {}
-    tickertape_links = {}
 
-    if res.ok:
-        soup = BeautifulSoup(res.content, features="html.parser")
-        mainTable = soup.select_one(".constituent-list-wrapper")
-        if not mainTable:
-            logging.info("Failed to get data from %s", baseUrl)
-            return results
-        subTables = mainTable.find_all("tr", {"class": "constituent-data-row"})
-
-        ## display number of stocks
-        logging.info(f"Number of stocks: {len(subTables)}")
-
-        def fetch_stock_data(s):
-            aTag = s.find("a", href=True)
-            sTag = s.find("span", {"class": "typography-caption-medium"})
-            apiTicker = aTag["href"].split("-")[-1]
-            tickertape_links[sTag.text] = f"https://www.tickertape.in{aTag['href']}"
-            base_api_url = f"https://api.tickertape.in/stocks/charts/inter/{apiTicker}"
-            returns = {}
-            current_price = -1.0
-
-            # Define fetch function with retries
-            @retry(
-                stop=stop_after_attempt(4),  # Stop after 4 attempts
-                wait=wait_exponential(
-                    multiplier=1, min=1, max=10
-                ),  # Wait 1, 2, 4, 8 seconds between retries
-                retry=retry_if_exception_type(
-                    (requests.exceptions.RequestException, ValueError)
-                ),
-                before_sleep=lambda retry_state: logging.info(
-                    f"Retrying {sTag.text} after {retry_state.outcome.exception()} - "
-                    f"Attempt {retry_state.attempt_number}"
-                ),
+    async def fetch_stock_data(member):
+        # Fetch data for each duration
+        durations = ["1y"] if single_fetch else DURATIONS
+        series = await fetch_durations(
+            tickerRequest, member["ticker"], durations, member["symbol"]
+        )
+
+        missing = [duration for duration in durations if duration not in series]
+        if missing and report is not None:
+            report.drop(member["symbol"], f"fetch failed for {', '.join(missing)}")
+
+        # If all durations were successfully fetched
+        if not missing:
+            fetched.append(
+                {
+                    "stock": member["name"],
+                    "symbol": member["symbol"],
+                    "series": series,
+                }
             )
-            def fetch_duration_data(duration):
-                apiUrl = f"{base_api_url}?duration={duration}"
-                logging.info(f"Fetching data for {sTag.text} last {duration}")
-
-                res = tickerRequest.get(apiUrl)
-                if not res.ok:
-                    raise requests.exceptions.RequestException(
-                        f"Failed with status {res.status_code}"
-                    )
-
-                res_json = res.json()
-                result = {"return": res_json["data"][0]["r"]}
-                data_points = res_json["data"][0]["points"]
-                result["vwap"] = calculate_vwap(data_points)
-                result["rsi"] = calculate_rsi(data_points)
-
-                return result, data_points[-1]["lp"] if duration == "1w" else None
-
-            # Fetch data for each duration
-            for duration in ["1y", "1mo", "1w"]:
-                try:
-                    result, price = fetch_duration_data(duration)
-                    returns[duration] = result
-                    if price is not None:
-                        current_price = price
-                except Exception as e:
-                    logging.error(
-                        f"Failed to get data for {sTag.text} {duration} after all retries: {e}"
-                    )
-                    continue
-
-            # If all durations were successfully fetched
-            if "1y" in returns and "1mo" in returns and "1w" in returns:
-                results.append(
-                    {
-                        "stock": aTag.text,
-                        "symbol": sTag.text,
-                        "returns": returns,
-                        "price": current_price,
-                    }
+
+    # Fetch all symbols concurrently on the shared event loop
+    async def fetch_all_stocks():
+        await asyncio.gather(*[fetch_stock_data(member) for member in members])
+
+    fetched = []
+    tickerRequest.fetcher.run(fetch_all_stocks())
+
+    # Indicators for every symbol and duration in one batch
+    keys = []
+    inputs = []
+    for stock in fetched:
+        if single_fetch:
+            period_return, data_points = stock["series"]["1y"]
+            stock_inputs = horizon_inputs(data_points, period_return)
+        else:
+            stock_inputs = {
+                duration: (period_return, data_points, data_points)
+                for duration, (period_return, data_points) in stock["series"].items()
+            }
+        for duration, stock_input in stock_inputs.items():
+            keys.append((stock, duration))
+            inputs.append(stock_input)
+
+    states = [
+        (
+            (rsi_state or {}).get(stock["symbol"], {}).get(duration)
+            if duration in RSI_RESUME_DURATIONS
+            else None
+        )
+        for stock, duration in keys
+    ]
+    returns = {}
+    for (stock, duration), result, state in zip(
+        keys, compute_indicators(inputs, states=states), states
+    ):
+        if (
+            rsi_state is not None
+            and state is not None
+            and duration in RSI_RESUME_DURATIONS
+        ):
+            rsi_state.setdefault(stock["symbol"], {})[duration] = state
+        if result is None:
+            logging.error(
+                f"Failed to calculate indicators for {stock['symbol']} {duration}"
+            )
+            continue
+        returns.setdefault(stock["symbol"], {})[duration] = result
+
+    for stock in fetched:
+        stock_returns = returns.get(stock["symbol"], {})
+        if not all(duration in stock_returns for duration in DURATIONS):
+            if report is not None:
+                report.drop(stock["symbol"], "indicators could not be computed")
+            continue
+        ## price is the latest point of the shortest horizon fetched
+        shortest = "1y" if single_fetch else "1w"
+        current_price = stock["series"][shortest][1][-1]["lp"]
+        results.append(
+            {
+                "stock": stock["stock"],
+                "symbol": stock["symbol"],
+                "returns": stock_returns,
+                "price": current_price,
+            }
+        )
+
+        if validation is not None and not single_fetch:
+            try:
+                data_points = stock["series"]["1y"][1]
+                validation[stock["symbol"]] = {
+                    "fetched": stock_returns,
+                    "price": current_price,
+                    "derived": derive_horizons(
+                        data_points, stock_returns["1y"]["return"]
+                    ),
+                    "derived_price": data_points[-1]["lp"],
+                }
+            except Exception as e:
+                logging.error(f"Failed to derive horizons for {stock['symbol']}: {e}")
+    return results
+
+
+## @brief Method to get the stock lists of several indices in one run
+## Symbols that are members of more than one index are fetched once and shared
+## @param urls: constituents page of every index, keyed by universe name
+## @param single_fetch: fetch only 1y per stock and derive the other horizons
+## @param validation: if a dict, collect fetched vs derived horizons per symbol
+## @param rsi_state: if a dict, RSI state of the previous run, updated in place
+## @param report: if a telemetry.RunReport, filled with per-symbol fetch telemetry
+## @param blob_service: BlobService the constituent lists are kept in
+## @return universes: (results, tickertape_links) keyed by universe name
+def getUniverseLists(
+    urls,
+    single_fetch=SINGLE_FETCH,
+    validation=None,
+    rsi_state=None,
+    report=None,
+    blob_service=None,
+):
+    tickerRequest = TickerRequest()
+    tickerRequest.report = report
+    tickerRequest.fetcher.start_run()
+
+    async def fetch_all_constituents():
+        return await asyncio.gather(
+            *[
+                constituents.fetch_constituents(
+                    url, fetch=tickerRequest.fetch, blob_service=blob_service
                 )
+                for url in urls.values()
+            ]
+        )
+
+    member_lists = dict(zip(urls, tickerRequest.fetcher.run(fetch_all_constituents())))
+    shared = {}
+    for members in member_lists.values():
+        for member in members.constituents or []:
+            shared.setdefault(member["symbol"], member)
+    ## display number of stocks
+    logging.info(
+        f"Number of stocks: {len(shared)} across {len(member_lists)} universes"
+    )
+    fetched = fetch_stock_records(
+        tickerRequest,
+        list(shared.values()),
+        single_fetch=single_fetch,
+        validation=validation,
+        rsi_state=rsi_state,
+        report=report,
+    )
 
-        # Use ThreadPoolExecutor for concurrent fetching
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            executor.map(fetch_stock_data, subTables)
+    universes = {}
+    for name, members in member_lists.items():
+        if not members.constituents:
+            logging.info("Failed to get data from %s", urls[name])
+            universes[name] = ([], {})
+            continue
+        symbols = {member["symbol"] for member in members.constituents}
+        ## scores are cross-sectional, every universe scores its own copies
+        results = [dict(stock) for stock in fetched if stock["symbol"] in symbols]
 
         # Cross-sectional z-score normalization across the universe
         compute_composite_scores(results)
 
         results = sorted(results, key=lambda x: x["composite_score"], reverse=True)
-    else:
-        logging.info("Failed to get data from %s", baseUrl)
-        ### show error message
-        logging.info(res.text)
-    return results, tickertape_links
+        tickertape_links = {
+            member["symbol"]: member["link"] for member in members.constituents
+        }
+        universes[name] = (results, tickertape_links)
+        logging.info(
+            f"{name}: {len(results)}/{len(members.constituents)} stocks fetched"
+        )
+    logging.info(f"Fetch stats: {tickerRequest.fetcher.stats()}")
+    if report is not None:
+        report.finish(len(shared))
+        logging.info(
+            f"Fetched {len(fetched)}/{report.universe} stocks, dropped {report.dropped}"
+        )
+    return universes
+
+
+## @brief Method to get list of stocks from tickertape
+## @param baseUrl: base url to fetch list of stocks
+## @param single_fetch: fetch only 1y per stock and derive the other horizons
+## @param validation: if a dict, collect fetched vs derived horizons per symbol
+## @param rsi_state: if a dict, RSI state of the previous run, updated in place
+## @param report: if a telemetry.RunReport, filled with per-symbol fetch telemetry
+## @param blob_service: BlobService the constituent list is kept in
+## @return results: list of stocks
+def getStockList(
+    baseUrl=constituents.NIFTY_200_URL,
+    single_fetch=SINGLE_FETCH,
+    validation=None,
+    rsi_state=None,
+    report=None,
+    blob_service=None,
+):
+    return getUniverseLists(
+        {baseUrl: baseUrl},
+        single_fetch=single_fetch,
+        validation=validation,
+        rsi_state=rsi_state,
+        report=report,
+        blob_service=blob_service,
+    )[baseUrl]
+
+
+## @brief Method to check if the NSE cash market is open
+## @param now: aware datetime, defaults to the current time
+## @return is_open: True between 09:15 and 15:30 IST on trading days
+def is_market_open(now=None):
+    now = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(IST)
+    if not trading_calendar.is_trading_day(now):
+        return False
+    return MARKET_OPEN <= now.time() <= MARKET_CLOSE
+
+
+## @brief Method to refresh only the 1w horizon of the stock lists of several indices
+## Symbols that joined an index since are fetched in full, ones that left are dropped,
+## and symbols shared by several indices are fetched once
+## @param universes: (data_items, baseUrl) keyed by universe name, data_items as
+## built earlier today by getUniverseLists
+## @param blob_service: BlobService the constituent lists are kept in
+## @return universes: list of stocks with fresh 1w data and price, re-scored and
+## sorted, keyed by universe name
+def refresh_universe_lists(universes, blob_service=None):
+    tickerRequest = TickerRequest()
+    tickerRequest.fetcher.start_run()
+
+    async def fetch_all_constituents():
+        return await asyncio.gather(
+            *[
+                constituents.fetch_constituents(
+                    baseUrl, fetch=tickerRequest.fetch, blob_service=blob_service
+                )
+                for _, baseUrl in universes.values()
+            ]
+        )
+
+    member_lists = dict(
+        zip(universes, tickerRequest.fetcher.run(fetch_all_constituents()))
+    )
+    known = {}
+    for data_items, _ in universes.values():
+        for stock in data_items:
+            known.setdefault(stock["symbol"], stock)
+    shared = {}
+    for members in member_lists.values():
+        for member in members.constituents or []:
+            shared.setdefault(member["symbol"], member)
+    jobs = [
+        (member, ["1w"] if member["symbol"] in known else DURATIONS)
+        for member in shared.values()
+    ]
+    logging.info(
+        f"Refreshing 1w data for {sum(len(d) == 1 for _, d in jobs)} stocks, "
+        f"full data for {sum(len(d) > 1 for _, d in jobs)} new stocks"
+    )
+
+    async def fetch_all_stocks():
+        return await asyncio.gather(
+            *[
+                fetch_durations(
+                    tickerRequest, member["ticker"], durations, member["symbol"]
+                )
+                for member, durations in jobs
+            ]
+        )
+
+    fetched = tickerRequest.fetcher.run(fetch_all_stocks())
+    keys = []
+    inputs = []
+    for (member, durations), series in zip(jobs, fetched):
+        for duration in durations:
+            if duration in series:
+                period_return, data_points = series[duration]
+                keys.append((member["symbol"], duration))
+                inputs.append((period_return, data_points, data_points))
+    returns = {}
+    for (symbol, duration), result in zip(keys, compute_indicators(inputs)):
+        if result is not None:
+            returns.setdefault(symbol, {})[duration] = result
+
+    ## keep the morning's 1y/1mo results, swap in the new 1w horizon and price
+    refreshed = {}
+    for (member, durations), series in zip(jobs, fetched):
+        stock_returns = returns.get(member["symbol"], {})
+        stock = known.get(member["symbol"])
+        if all(duration in stock_returns for duration in durations):
+            base = stock["returns"] if stock else {}
+            stock = {
+                "stock": member["name"],
+                "symbol": member["symbol"],
+                "returns": dict(base, **stock_returns),
+                "price": series["1w"][1][-1]["lp"],
+            }
+        if stock is not None:
+            refreshed[member["symbol"]] = stock
+    logging.info(f"Fetch stats: {tickerRequest.fetcher.stats()}")
+
+    results = {}
+    for name, members in member_lists.items():
+        data_items, baseUrl = universes[name]
+        if not members.constituents:
+            logging.info("Failed to get data from %s", baseUrl)
+            results[name] = data_items
+            continue
+        ## scores are cross-sectional, every universe scores its own copies
+        stocks = [
+            dict(refreshed[member["symbol"]])
+            for member in members.constituents
+            if member["symbol"] in refreshed
+        ]
+        logging.info(
+            f"{name}: refreshed {len(stocks)}/{len(members.constituents)} stocks"
+        )
+        compute_composite_scores(stocks)
+        results[name] = sorted(stocks, key=lambda x: x["composite_score"], reverse=True)
+    return results
+
+
+## @brief Method to refresh only the 1w horizon of a stock list built earlier today
+## Symbols that joined the index since are fetched in full, ones that left are dropped
+## @param data_items: list of stocks from getStockList
+## @param baseUrl: constituents page of the index
+## @param blob_service: BlobService the constituent list is kept in
+## @return results: list of stocks with fresh 1w data and price, re-scored and sorted
+def refresh_stock_list(
+    data_items, baseUrl=constituents.NIFTY_200_URL, blob_service=None
+):
+    return refresh_universe_lists(
+        {baseUrl: (data_items, baseUrl)}, blob_service=blob_service
+    )[baseUrl]
+
+
+## @brief Method to compare derived horizons against the three-call path
+## @param validation: dict collected by getStockList(validation={})
+## @param top_n: portfolio size to compare rankings for
+## @return report: drift per duration and field, plus ranking agreement
+def single_fetch_report(validation, top_n=15):
+    def _drift(pairs):
+        abs_diffs = [abs(d - f) for f, d in pairs]
+        rel_diffs = [abs(d - f) / abs(f) * 100.0 for f, d in pairs if f]
+        return {
+            "mean_abs": sum(abs_diffs) / len(abs_diffs),
+            "max_abs": max(abs_diffs),
+            "mean_rel_pct": sum(rel_diffs) / len(rel_diffs) if rel_diffs else 0.0,
+        }
+
+    report = {"symbols": len(validation), "fields": {}}
+    if not validation:
+        return report
+    for duration in DURATIONS:
+        for field in ["return", "vwap", "rsi"]:
+            report["fields"][f"{duration}_{field}"] = _drift(
+                [
+                    (v["fetched"][duration][field], v["derived"][duration][field])
+                    for v in validation.values()
+                ]
+            )
+    report["fields"]["price"] = _drift(
+        [(v["price"], v["derived_price"]) for v in validation.values()]
+    )
+
+    ## rank the universe both ways and compare the portfolios they would pick
+    rankings = {}
+    for mode, returns_key, price_key in [
+        ("fetched", "fetched", "price"),
+        ("derived", "derived", "derived_price"),
+    ]:
+        items = [
+            {"symbol": symbol, "returns": v[returns_key], "price": v[price_key]}
+            for symbol, v in validation.items()
+        ]
+        compute_composite_scores(items)
+        items = sorted(items, key=lambda x: x["composite_score"], reverse=True)
+        rankings[mode] = {item["symbol"]: rank for rank, item in enumerate(items)}
+
+    n = len(validation)
+    top_fetched = {s for s, r in rankings["fetched"].items() if r < top_n}
+    top_derived = {s for s, r in rankings["derived"].items() if r < top_n}
+    squared_rank_diffs = sum(
+        (rankings["fetched"][s] - rankings["derived"][s]) ** 2 for s in validation
+    )
+    report["ranking"] = {
+        "top_n": top_n,
+        "top_n_overlap": len(top_fetched & top_derived),
+        "spearman": (1 - 6 * squared_rank_diffs / (n * (n * n - 1)) if n > 1 else 1.0),
+        "max_rank_shift": max(
+            abs(rankings["fetched"][s] - rankings["derived"][s]) for s in validation
+        ),
+    }
+    return report
 
 
 ## @brief Method to display portfolio
@@ -440,31 +943,49 @@ def load_portfolio(fileName):
 ## @param investment: investment amount
 ## @return portfolio: portfolio
 def build_portfolio(data_items, N=10, investment=100000):
-    ## Take top N stocks, clone it
-    portfolio = []
+    ## Take top N affordable stocks by score, without sorting or copying the rest
     weight = round(100 / N, 2)
-    ## filter out stocks with price greater than investment amount
-    data_items = [
-        stock
-        for stock in data_items
-        if int(investment * weight / 100.0 / stock["price"]) > 0
-    ]
-    for stock in data_items[:N]:
-        portfolio.append(stock.copy())
+    rows = scoring.top_affordable(
+        [stock.get("composite_score", 0) for stock in data_items],
+        [stock["price"] for stock in data_items],
+        N,
+        investment,
+        weight,
+    )
+    return _portfolio_entries([data_items[row] for row in rows.tolist()], N, investment)
+
 
-    ## calculate weight
-    for stock in portfolio:
-        stock["weight"] = weight
+## @brief Method to build portfolio straight from snapshot columns
+## only the picked rows are turned into stock dicts
+## @param columns: snapshot.decode() of a day
+## @return portfolio: same as build_portfolio
+def build_portfolio_from_snapshot(columns, N=10, investment=100000):
+    weight = round(100 / N, 2)
+    rows = scoring.top_affordable(
+        columns["composite_score"], columns["price"], N, investment, weight
+    )
+    return _portfolio_entries(
+        snapshot.to_records(columns, rows.tolist()), N, investment
+    )
 
-    ## calculate number of shares
-    for stock in portfolio:
-        stock["shares"] = int(investment * stock["weight"] / 100.0 / stock["price"])
-        if stock["shares"] == 0:
+
+def _portfolio_entries(stocks, N, investment):
+    weight = round(100 / N, 2)
+    portfolio = []
+    for stock in stocks:
+        shares = int(investment * weight / 100.0 / stock["price"])
+        if shares == 0:
             raise ValueError(
                 "Investment amount is less than price of highest priced stock"
             )
-        stock["investment"] = stock["shares"] * stock["price"]
-
+        portfolio.append(
+            dict(
+                stock,
+                weight=weight,
+                shares=shares,
+                investment=shares * stock["price"],
+            )
+        )
     return portfolio
 
 
@@ -497,54 +1018,10 @@ def get_stock_info(portfolio_data):
 def rebalance_portfolio(
     previous_day_portfolio, current_day_portfolio, current_day_price_dict
 ):
-    capital_incurred = 0
-    result = {"stocks": [], "capital_incurred": ""}
-
-    day1_stock_info = get_stock_info(previous_day_portfolio)
-    day2_stock_info = get_stock_info(current_day_portfolio)
-    # Calculate the current value of each stock on Day 2
-    for stock, info in day1_stock_info.items():
-        shares_day1 = info.get("shares", 0)
-        shares_day2 = day2_stock_info.get(stock, {}).get("shares", 0)
-        try:
-            price_day2 = current_day_price_dict[stock]
-        except KeyError:
-            logging.warning("Price not available for %s", {stock})
-            price_day2 = info.get(
-                "price", 0
-            )  ## use previous day price if not available
-        amount = (shares_day2 - shares_day1) * price_day2
-        result["stocks"].append(
-            {
-                "symbol": stock,
-                "shares": shares_day2 - shares_day1,
-                "amount": amount,
-            }
-        )
-        # Calculate the profit or loss for this stock
-        capital_incurred += amount
-
-    # Calculate the new stocks to buy on Day 2
-    for stock, info in day2_stock_info.items():
-        if not stock in day1_stock_info:
-            shares_day2 = info.get("shares", 0)
-            price_day2 = current_day_price_dict[stock]
-            amount = shares_day2 * price_day2
-            result["stocks"].append(
-                {"symbol": stock, "shares": shares_day2, "amount": amount}
-            )
-            capital_incurred += amount  ## Buy new stocks
-
-    ##  sort the list of dictionaries based on the "shares" value in ascending order
-    ##  so that the "no change" items come first, followed by "sold" items, and then "bought" items,
-    ## and then at last sort by symbol
-    result["stocks"] = sorted(
-        result["stocks"],
-        key=lambda x: (x["shares"] == 0, x["shares"] < 0, x["symbol"]),
-        reverse=True,
-    )
-    result["capital_incurred"] = capital_incurred
-    return result
+    ## a single pair of the batch engine, see rebalance.Holdings
+    return Holdings(
+        {"from": previous_day_portfolio, "to": current_day_portfolio}
+    ).rebalance([("from", "to")], {"to": current_day_price_dict})[0]
 
 
 ## Get the stcok-nifty-200-YYYY-MM-DD.json file from the tickertape
@@ -574,10 +1051,53 @@ if __name__ == "__main__":
     # regenrate_stock_list(fileName)
     # sys.exit(0)
 
-    date_provided = len(sys.argv) == 2
+    parser = argparse.ArgumentParser()
+    parser.add_argument("date", nargs="?", help="YYYY-MM-DD of the stock list")
+    parser.add_argument(
+        "--validate-single-fetch",
+        action="store_true",
+        help="Compare 1y-derived horizons against the three-call path and exit",
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Serve tickertape responses from the http cache, store misses",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Serve tickertape responses from the http cache only (offline)",
+    )
+    parser.add_argument("--cache-dir", default=http_cache.HTTP_CACHE_DIR)
+    parser.add_argument(
+        "--regenerate", metavar="FILE", help="Rescore a saved stock list and exit"
+    )
+    args = parser.parse_args()
+
+    if args.replay or args.record:
+        http_cache.configure(
+            mode="replay" if args.replay else "record",
+            root=args.cache_dir,
+            date=args.date,
+        )
+
+    if args.regenerate:
+        regenrate_stock_list(args.regenerate)
+        sys.exit(0)
+
+    if args.validate_single_fetch:
+        validation = {}
+        getStockList(single_fetch=False, validation=validation)
+        report = single_fetch_report(validation)
+        with open(get_file_name("single-fetch-report"), "w") as fh:
+            json.dump(report, fh, indent=2)
+        logging.info(json.dumps(report, indent=2))
+        sys.exit(0)
+
+    date_provided = args.date is not None
     if date_provided:
-        logging.info(f"Date provided: {sys.argv[1]}")
-        fileName = f"nifty200-symbols-{sys.argv[1]}.json"
+        logging.info(f"Date provided: {args.date}")
+        fileName = f"nifty200-symbols-{args.date}.json"
     ## filename : stocks-nifty-200-YYYY-MM-DD.json
     else:
         fileName = get_file_name()
@@ -591,8 +1111,12 @@ if __name__ == "__main__":
             json.dump(nifty200_symbols, fh, indent=2)
         with open("tickertape_links.json", "w") as fh:
             json.dump(tickertape_links, fh, indent=2)
+        nifty200_data = fetch_nifty_200_data()
+        if nifty200_data:
+            with open("nifty200-data.json", "w") as fh:
+                json.dump(nifty200_data, fh, indent=2)
     if date_provided:
-        fileName = f"portfolio-on-{sys.argv[1]}.json"
+        fileName = f"portfolio-on-{args.date}.json"
     else:
         fileName = get_file_name("portfolio-on")
     portfolio = load_portfolio(fileName)
@@ -612,7 +1136,7 @@ if __name__ == "__main__":
             previous_day_portfolio = json.load(fh)
             display_portfolio(previous_day_portfolio, "Previous Day Portfolio")
             if date_provided:
-                rebalance_file_name = f"rebalance-on-{sys.argv[1]}.json"
+                rebalance_file_name = f"rebalance-on-{args.date}.json"
             else:
                 rebalance_file_name = get_file_name("rebalance-on")
             if True or not pathlib.Path(rebalance_file_name).exists():
@@ -0,0 +1,130 @@
+"""
+Record/replay cache of raw tickertape responses.
+
+Bodies are stored once under their SHA-256 (`objects/`), and a small ref file
+keyed by URL, duration and trading date points at them (`refs/<date>/`).
+Modes:
+- off: always go to the network
+- record: serve from the cache, fetch and store on a miss
+- replay: serve from the cache only, a miss is an error (fully offline)
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pathlib
+from urllib.parse import parse_qs, urlsplit
+
+import trading_calendar
+from fetcher import FetchError, FetchResponse
+
+logging = logging.getLogger(__name__)
+
+## Read from the environment variable
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", ".http-cache")
+HTTP_CACHE_MODE = os.getenv("HTTP_CACHE_MODE", "off")
+
+MODES = ("off", "record", "replay")
+
+
+def trading_date(today=None):
+    """Date whose market data a request made `today` returns (weekends and NSE
+    holidays map to the previous trading day)."""
+    today = today or datetime.date.today()
+    if trading_calendar.is_trading_day(today):
+        return today.strftime("%Y-%m-%d")
+    return trading_calendar.previous_trading_day(today)
+
+
+class HttpCache:
+    """Content-addressed on-disk response cache."""
+
+    def __init__(self, root=HTTP_CACHE_DIR, mode=HTTP_CACHE_MODE, date=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode}, expected one of {MODES}")
+        self.root = pathlib.Path(root)
+        self.mode = mode
+        self.date = date
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def _ref_path(self, url):
+        date = self.date or trading_date()
+        duration = parse_qs(urlsplit(url).query).get("duration", [""])[0]
+        key = hashlib.sha256(f"{url}|{duration}|{date}".encode()).hexdigest()
+        return self.root / "refs" / date / f"{key}.json"
+
+    def _object_path(self, digest):
+        return self.root / "objects" / digest[:2] / digest
+
+    @staticmethod
+    def _write(path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def get(self, url):
+        """Cached response for `url`, None on a miss."""
+        ref_path = self._ref_path(url)
+        if not ref_path.exists():
+            return None
+        ref = json.loads(ref_path.read_bytes())
+        object_path = self._object_path(ref["sha256"])
+        if not object_path.exists():
+            logging.warning("cache object missing for %s", url)
+            return None
+        return FetchResponse(
+            url, ref["status_code"], ref["headers"], object_path.read_bytes(), 0.0
+        )
+
+    def put(self, url, response):
+        """Store a 200 response."""
+        digest = hashlib.sha256(response.content).hexdigest()
+        object_path = self._object_path(digest)
+        if not object_path.exists():
+            self._write(object_path, response.content)
+        ref = {
+            "url": url,
+            "sha256": digest,
+            "status_code": response.status_code,
+            "headers": {
+                k: v for k, v in response.headers.items() if k.lower() == "content-type"
+            },
+            "fetched_at": datetime.datetime.now().isoformat(),
+        }
+        self._write(self._ref_path(url), json.dumps(ref).encode())
+
+    async def fetch(self, fetcher, url, **kwargs):
+        """Coroutine: serve `url` according to the cache mode."""
+        if self.enabled:
+            cached = self.get(url)
+            if cached is not None:
+                logging.debug("http cache hit for %s", url)
+                return cached
+            if self.mode == "replay":
+                raise FetchError(f"{url}: not in replay cache {self.root}")
+        response = await fetcher.fetch(url, **kwargs)
+        ## a 304 has no body to replay, only full responses are recorded
+        if self.mode == "record" and response.status_code == 200:
+            self.put(url, response)
+        return response
+
+
+_cache = HttpCache()
+
+
+def configure(mode=HTTP_CACHE_MODE, root=HTTP_CACHE_DIR, date=None):
+    """Replace the process-wide cache, e.g. from a --replay command line flag."""
+    global _cache
+    _cache = HttpCache(root=root, mode=mode, date=date)
+    logging.info("http cache mode %s at %s", mode, root)
+    return _cache
+
+
+def get_cache():
+    return _cache
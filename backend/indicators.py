@@ -0,0 +1,152 @@
+"""
+Batch NumPy indicator kernels over a padded symbols x points matrix.
+
+The kernels vectorise across symbols and walk the time axis in the same order
+as `get_stocks.calculate_rsi` / `get_stocks.calculate_vwap`, so every symbol
+gets bit-identical results to the scalar functions. Where the scalar
+functions raise (too few points, zero volume, no losses) the kernels return
+NaN for that row instead.
+"""
+
+import numpy as np
+
+
+def pad_points(series, fields=("lp", "v")):
+    """Pack lists of data points into zero-padded matrices.
+    @param series: list of data point lists, one per symbol
+    @param fields: data point keys to extract
+    @return one (symbols x max points) float64 matrix per field, and the lengths
+    """
+    lengths = np.array([len(points) for points in series], dtype=np.int64)
+    width = int(lengths.max()) if len(series) else 0
+    ## row-major boolean mask lines up with the flattened points
+    mask = np.arange(width) < lengths[:, None]
+    matrices = []
+    for field in fields:
+        matrix = np.zeros((len(series), width), dtype=np.float64)
+        matrix[mask] = np.fromiter(
+            (point[field] for points in series for point in points),
+            dtype=np.float64,
+            count=int(lengths.sum()),
+        )
+        matrices.append(matrix)
+    return matrices, lengths
+
+
+def batch_rsi(prices, lengths, period=14, return_state=False):
+    """Wilder RSI of every row, NaN where it is undefined.
+    @param prices: (symbols x points) matrix, rows padded after `lengths`
+    @param lengths: number of valid points per row
+    @param period: RSI period
+    @param return_state: also return the final smoothed average gain and loss
+    @return rsi: array of RSI per row, or (rsi, avg_gain, avg_loss)
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    lengths = np.asarray(lengths)
+    rows, width = prices.shape
+    if width < 2:
+        nan = np.full(rows, np.nan)
+        return (nan, nan, nan) if return_state else nan
+
+    diffs = prices[:, 1:] - prices[:, :-1]
+    gains = np.where(diffs > 0, diffs, 0.0)
+    losses = np.where(diffs > 0, 0.0, np.abs(diffs))
+
+    avg_gain = np.zeros(rows)
+    avg_loss = np.zeros(rows)
+    # Seed with the sum of the first 'period' moves, added left to right
+    for i in range(min(period, width - 1)):
+        avg_gain += gains[:, i]
+        avg_loss += losses[:, i]
+    avg_gain /= period
+    avg_loss /= period
+
+    # Wilder smoothing; a zero move on the other side adds exactly 0.0
+    for i in range(period, width - 1):
+        active = i + 1 < lengths
+        avg_gain = np.where(
+            active, ((period - 1) * avg_gain + gains[:, i]) / period, avg_gain
+        )
+        avg_loss = np.where(
+            active, ((period - 1) * avg_loss + losses[:, i]) / period, avg_loss
+        )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = avg_gain / avg_loss
+        rsi = 100 - (100 / (1 + rs))
+    rsi = np.where((lengths >= period + 1) & (avg_loss != 0), rsi, np.nan)
+    if return_state:
+        return rsi, avg_gain, avg_loss
+    return rsi
+
+
+def batch_vwap(prices, volumes, lengths=None):
+    """Volume weighted average price of every row, NaN for zero volume.
+    @param prices: (symbols x points) matrix
+    @param volumes: (symbols x points) matrix
+    @param lengths: number of valid points per row, None if padding is zero
+    @return vwap: array of VWAP per row
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    if lengths is not None:
+        mask = np.arange(prices.shape[1]) < np.asarray(lengths)[:, None]
+        prices = np.where(mask, prices, 0.0)
+        volumes = np.where(mask, volumes, 0.0)
+    total_price_volume = np.zeros(prices.shape[0])
+    total_volume = np.zeros(prices.shape[0])
+    # Accumulate left to right like the scalar sum(), not pairwise like np.sum
+    for i in range(prices.shape[1]):
+        total_price_volume += prices[:, i] * volumes[:, i]
+        total_volume += volumes[:, i]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vwap = total_price_volume / total_volume
+    return np.where(total_volume != 0, vwap, np.nan)
+
+
+def rsi_state(avg_gain, avg_loss, point, period=14):
+    """Wilder smoothing state after `point`, enough to resume the RSI later."""
+    return {
+        "ts": point.get("ts"),
+        "lp": point["lp"],
+        "avg_gain": avg_gain,
+        "avg_loss": avg_loss,
+        "period": period,
+    }
+
+
+def update_rsi(state, data_points, period=14):
+    """Advance a saved smoothing state with only the points after `state["ts"]`.
+    @param state: state returned by rsi_state for an earlier run
+    @param data_points: current series, which must still contain the point of
+    `state["ts"]` at the price `state["lp"]`
+    @param period: RSI period
+    @return (rsi, new state), or None if the state cannot be resumed on this series
+    """
+    if not state or state.get("period") != period or state.get("ts") is None:
+        return None
+    for start in range(len(data_points) - 1, -1, -1):
+        if data_points[start].get("ts") == state["ts"]:
+            break
+    else:
+        return None
+    # an adjusted series, e.g. after a split, keeps its timestamps
+    if data_points[start]["lp"] != state["lp"]:
+        return None
+
+    avg_gain = state["avg_gain"]
+    avg_loss = state["avg_loss"]
+    last_price = state["lp"]
+    # Same Wilder step as calculate_rsi, applied to the new points only
+    for point in data_points[start + 1 :]:
+        diff = point["lp"] - last_price
+        if diff > 0:
+            avg_gain = ((period - 1) * avg_gain + diff) / period
+            avg_loss = ((period - 1) * avg_loss) / period
+        else:
+            avg_gain = ((period - 1) * avg_gain) / period
+            avg_loss = ((period - 1) * avg_loss + abs(diff)) / period
+        last_price = point["lp"]
+
+    rsi = 100 - (100 / (1 + avg_gain / avg_loss)) if avg_loss else float("nan")
+    return rsi, rsi_state(avg_gain, avg_loss, data_points[-1], period)
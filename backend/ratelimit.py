@@ -0,0 +1,216 @@
+"""
+Process-wide flow control for the shared fetcher.
+
+Every host gets an adaptive token bucket and a circuit breaker, and the whole
+process shares one retry budget per run:
+- the bucket rate grows additively while responses are fast and healthy, and
+  is cut multiplicatively on 429/5xx or slow responses (AIMD), honouring
+  `Retry-After` by pausing the bucket
+- the breaker opens after consecutive failures, fails calls fast while open
+  and lets a single probe through after the cooldown
+- the retry budget caps the total number of retries of a run, so a bad
+  upstream costs a bounded number of extra calls instead of a retry storm
+
+All state is touched only from the fetcher's event loop thread.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+logging = logging.getLogger(__name__)
+
+## Read from the environment variable
+FETCH_RATE = float(os.getenv("FETCH_RATE", 20))
+FETCH_MIN_RATE = float(os.getenv("FETCH_MIN_RATE", 1))
+FETCH_MAX_RATE = float(os.getenv("FETCH_MAX_RATE", 100))
+FETCH_LATENCY_TARGET = float(os.getenv("FETCH_LATENCY_TARGET", 2.0))
+FETCH_RETRY_BUDGET = int(os.getenv("FETCH_RETRY_BUDGET", 200))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", 10))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 30))
+
+RATE_INCREASE = 0.5
+RATE_DECREASE = 0.5
+SLOW_DECREASE = 0.9
+MAX_RETRY_AFTER = 60
+
+
+def is_throttled(status_code):
+    """Responses that mean the upstream wants us to slow down."""
+    return status_code == 429 or status_code >= 500
+
+
+def retry_after_seconds(headers):
+    """Seconds from a numeric `Retry-After` header, None if absent or a date."""
+    value = (headers or {}).get("Retry-After")
+    try:
+        return min(float(value), MAX_RETRY_AFTER) if value is not None else None
+    except ValueError:
+        return None
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate follows an AIMD rule."""
+
+    def __init__(
+        self, rate=FETCH_RATE, min_rate=FETCH_MIN_RATE, max_rate=FETCH_MAX_RATE
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._tokens = max(1.0, rate)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        ## a burst of about one second worth of requests at the current rate
+        capacity = max(1.0, self.rate)
+        self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Coroutine: wait for a token."""
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self._paused_until and self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep(
+                max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            )
+
+    def on_success(self, latency):
+        if latency > FETCH_LATENCY_TARGET:
+            self.rate = max(self.min_rate, self.rate * SLOW_DECREASE)
+        else:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def on_throttle(self, retry_after=None):
+        self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+        self._tokens = min(self._tokens, 0.0)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+class CircuitBreaker:
+    """Closed -> open after `threshold` consecutive failures -> half open after `cooldown`."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """True if a call may go out now; only one probe while half open."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            if self.opened_at is None or self._probing:
+                logging.warning("circuit opened after %d failures", self.failures)
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def record_abort(self):
+        """A call ended without an outcome, e.g. cancelled or a decode error.
+        Counts as failed only for the probe, so the circuit reopens and the next
+        probe goes out after the cooldown instead of never."""
+        if self._probing:
+            self.record_failure()
+
+
+class RetryBudget:
+    """Total retries allowed in a run, shared by every caller in the process.
+    Usable directly as a tenacity `retry` predicate."""
+
+    def __init__(self, budget=FETCH_RETRY_BUDGET):
+        self.budget = budget
+        self.spent = 0
+        self.denied = 0
+
+    def reset(self, budget=None):
+        if budget is not None:
+            self.budget = budget
+        self.spent = 0
+        self.denied = 0
+
+    def try_spend(self):
+        if self.spent >= self.budget:
+            self.denied += 1
+            if self.denied == 1:
+                logging.warning("retry budget of %d exhausted", self.budget)
+            return False
+        self.spent += 1
+        return True
+
+    def __call__(self, retry_state):
+        return self.try_spend()
+
+
+class HostGuard:
+    """Rate limiter, circuit breaker and counters of one host."""
+
+    def __init__(self, host):
+        self.host = host
+        self.limiter = AdaptiveRateLimiter()
+        self.breaker = CircuitBreaker()
+        self.counters = {"requests": 0, "throttled": 0, "failed": 0, "rejected": 0}
+
+    async def acquire(self):
+        """Coroutine: wait for a token, False if the circuit rejects the call."""
+        if not self.breaker.allow():
+            self.counters["rejected"] += 1
+            return False
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            self.breaker.record_abort()
+            raise
+        self.counters["requests"] += 1
+        return True
+
+    def on_response(self, status_code, headers, latency):
+        if is_throttled(status_code):
+            self.counters["throttled"] += 1
+            self.limiter.on_throttle(retry_after_seconds(headers))
+            self.breaker.record_failure()
+        else:
+            self.limiter.on_success(latency)
+            self.breaker.record_success()
+
+    def on_error(self):
+        self.counters["failed"] += 1
+        self.limiter.on_throttle()
+        self.breaker.record_failure()
+
+    def on_abort(self):
+        self.breaker.record_abort()
+
+    def stats(self):
+        return dict(
+            self.counters, rate=round(self.limiter.rate, 2), circuit=self.breaker.state
+        )
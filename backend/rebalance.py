@@ -0,0 +1,157 @@
+"""
+Batch rebalancing of portfolios.
+
+Portfolios of many dates are held as (dates x symbols) matrices of shares,
+portfolio prices and portfolio positions. The trades of any set of (from, to)
+date pairs are then one subtraction `shares[to] - shares[from]` and one
+price lookup for all pairs at once, instead of a dict walk per pair.
+
+Results keep the format of `get_stocks.rebalance_portfolio`: stocks of the
+from portfolio in portfolio order, then the stocks new in the to portfolio,
+sorted for display, and `capital_incurred` summed left to right in that same
+order (`np.cumsum`), so it is bit-identical to the scalar loop.
+
+A trade is priced at the to date's price list; a stock missing from it falls
+back to the from portfolio's price if it was held, else to the to portfolio's.
+"""
+
+import logging
+
+import numpy as np
+
+logging = logging.getLogger(__name__)
+
+
+class Holdings:
+    """Share matrix of a set of portfolios keyed by date."""
+
+    def __init__(self, portfolios):
+        self.dates = list(portfolios)
+        self.index = {date: d for d, date in enumerate(self.dates)}
+        symbols = {}
+        for portfolio in portfolios.values():
+            for stock in portfolio:
+                symbols.setdefault(stock["symbol"], len(symbols))
+        self.symbols = list(symbols)
+
+        shape = (len(self.dates), len(self.symbols))
+        all_shares = [s["shares"] for p in portfolios.values() for s in p]
+        is_int = all(isinstance(v, (int, np.integer)) for v in all_shares)
+        ## integer shares stay integers in the results, like the scalar code
+        self.shares = np.zeros(shape, dtype=np.int64 if is_int else np.float64)
+        self.prices = np.zeros(shape)
+        self.held = np.zeros(shape, dtype=bool)
+        ## position of a symbol in its portfolio, first occurrence wins
+        self.position = np.full(shape, len(self.symbols), dtype=np.int64)
+        for d, portfolio in enumerate(portfolios.values()):
+            held = 0
+            for stock in portfolio:
+                j = symbols[stock["symbol"]]
+                ## a repeated symbol keeps its first position and last values
+                if not self.held[d, j]:
+                    self.position[d, j] = held
+                    held += 1
+                self.held[d, j] = True
+                self.shares[d, j] = stock["shares"]
+                self.prices[d, j] = stock.get("price", 0)
+
+    def _symbol_rank(self):
+        """Rank of every symbol column in sorted symbol order."""
+        rank = np.empty(len(self.symbols), dtype=np.int64)
+        rank[np.argsort(np.asarray(self.symbols, dtype=str), kind="stable")] = (
+            np.arange(len(self.symbols))
+        )
+        return rank
+
+    def price_matrix(self, price_lists):
+        """(dates x symbols) prices from {date: {symbol: price}}, NaN where missing."""
+        columns = {symbol: j for j, symbol in enumerate(self.symbols)}
+        matrix = np.full((len(self.dates), len(self.symbols)), np.nan)
+        for date, price_list in (price_lists or {}).items():
+            if date not in self.index or not price_list:
+                continue
+            d = self.index[date]
+            for symbol, price in price_list.items():
+                j = columns.get(symbol)
+                if j is not None and price is not None:
+                    matrix[d, j] = price
+        return matrix
+
+    def rebalance(self, pairs, price_lists):
+        """Rebalance results of (from_date, to_date) pairs, in the order given.
+        @param price_lists: {date: {symbol: price}}, a pair trades at its to date's list
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return []
+        f = np.array([self.index[from_date] for from_date, _ in pairs])
+        t = np.array([self.index[to_date] for _, to_date in pairs])
+        n_symbols = len(self.symbols)
+
+        held_from, held_to = self.held[f], self.held[t]
+        listed = self.price_matrix(price_lists)[t]
+        price = np.where(
+            np.isnan(listed),
+            np.where(held_from, self.prices[f], self.prices[t]),
+            listed,
+        )
+        delta = np.where(held_from, self.shares[t] - self.shares[f], self.shares[t])
+        included = held_from | held_to
+        amount = np.where(included, delta * price, 0.0)
+
+        ## from stocks in portfolio order, then new stocks, then the rest
+        order_key = np.where(
+            held_from,
+            self.position[f],
+            np.where(held_to, n_symbols + self.position[t], 2 * n_symbols),
+        )
+        order = np.argsort(order_key, axis=1, kind="stable")
+        capital = np.cumsum(np.take_along_axis(amount, order, axis=1), axis=1)
+
+        missing = np.isnan(listed) & included
+        for p in np.flatnonzero(missing.any(axis=1)).tolist():
+            logging.warning(
+                "Price not available on %s for %s",
+                pairs[p][1],
+                [self.symbols[j] for j in np.flatnonzero(missing[p])],
+            )
+
+        ## display order: "no change" items first, followed by "sold" items,
+        ## and then "bought" items, each by symbol descending; the rest last
+        group = np.select([~included, delta == 0, delta < 0], [3, 0, 1], 2)
+        symbol_key = np.broadcast_to(-self._symbol_rank(), group.shape)
+        display = np.lexsort((symbol_key, group), axis=1)
+        ## back to Python values in bulk, per element numpy scalars are slow;
+        ## included stocks sort first, so the widest pair bounds the columns
+        counts = np.count_nonzero(included, axis=1)
+        display = display[:, : int(counts.max())]
+        results = []
+        for columns, shares, amounts, count, total in zip(
+            display.tolist(),
+            np.take_along_axis(delta, display, axis=1).tolist(),
+            np.take_along_axis(amount, display, axis=1).tolist(),
+            counts.tolist(),
+            capital[:, -1].tolist() if n_symbols else [0] * len(pairs),
+        ):
+            results.append(
+                {
+                    "stocks": [
+                        {"symbol": self.symbols[j], "shares": s, "amount": a}
+                        for j, s, a in zip(columns[:count], shares, amounts)
+                    ],
+                    "capital_incurred": total if count else 0,
+                }
+            )
+        return results
+
+
+def rebalance_many(portfolios, pairs, price_lists):
+    """Rebalance results of many date pairs at once.
+    @param portfolios: {date: portfolio list}
+    @param pairs: (from_date, to_date) pairs, dates must be keys of `portfolios`
+    @param price_lists: {date: {symbol: price}}
+    @return {(from_date, to_date): {"stocks": [...], "capital_incurred": float}}
+    """
+    pairs = list(pairs)
+    results = Holdings(portfolios).rebalance(pairs, price_lists)
+    return dict(zip(pairs, results))
@@ -1,13 +1,14 @@
 """Generates valuation scores for stocks in the Nifty 200 index."""
+
+import asyncio
 import logging
-import concurrent.futures
 import json
-from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from bs4 import BeautifulSoup
 from tqdm import tqdm
 
+import constituents
+from fetcher import get_fetcher
+
 ##pylint: disable=invalid-name
 
 
@@ -39,43 +40,56 @@ def score_stock(score_card):
     return score
 
 
-### @brief Method to fetch multiple urls using a single session
+### @brief Coroutine to fetch multiple urls on the shared connection pool
 ### @param urls: list of urls to fetch
 ### @return list of responses
-def fetch_all(urls):
-    """Fetch multiple URLs using a single session."""
-    with requests.Session() as session:
-        with ThreadPoolExecutor() as executor:
-            return list(executor.map(session.get, urls))
+async def fetch_all(urls):
+    """Fetch multiple URLs concurrently on the shared event loop."""
+    fetcher = get_fetcher()
+    return await asyncio.gather(*[fetcher.fetch(url) for url in urls])
+
+
+## @brief Method to parse the scorecard and price responses of a stock
+## @param apiTicker: ticker id of the stock
+## @param res: scorecard and 1w price FetchResponse
+## @return (score_card, composite_score, price)
+def parse_stock_data(apiTicker, res):
+    score_card = []
+    composite_score = 0
+    price = 0
+    if res[0].ok:
+        res_json = res[0].json()
+        score_card = {item["name"]: item["colour"] for item in res_json["data"]}
+        composite_score = score_stock(score_card)
+    else:
+        logging.info("Reponse failed to get data for %s", apiTicker)
+    if res[1].ok:
+        price_data = res[1].json()
+        ## add price data
+        price = price_data["data"][0]["points"][-1]["lp"]
+    return score_card, composite_score, price
 
 
 ## @brief Method to get list of stocks from tickertape
 ## @param baseUrl: base url to fetch list of stocks
+## @param blob_service: BlobService the constituent list is kept in
 ## @return results: list of stocks
 ## pylint:disable=too-many-statements,line-too-long
 def getStockList(
-    baseUrl="https://www.tickertape.in/indices/nifty-200-index-.NIFTY200/constituents?type=marketcap",
+    baseUrl=constituents.NIFTY_200_URL,
+    blob_service=None,
 ):
     """Web scrapper"""
-    res = requests.get(baseUrl, timeout=10)
+    fetcher = get_fetcher()
+    fetcher.start_run()
+    members = constituents.get_constituents(baseUrl, blob_service=blob_service)
     results = []
     retries = {}
-    tickertape_links = {}
-
-    if res.ok:
-        soup = BeautifulSoup(res.content, features="html.parser")
-        mainTable = soup.select_one(".constituent-list-wrapper")
-        if not mainTable:
-            logging.info("Failed to get data from %s", baseUrl)
-            return results
-        subTables = mainTable.find_all("tr", {"class": "constituent-data-row"})
-
-        def fetch_stock_data(s, retry=False):
-            aTag = s.find("a", href=True)
-            sTag = s.find("span", {"class": "typography-caption-medium"})
-            apiTicker = aTag["href"].split("-")[-1]
-            tLink = f"https://www.tickertape.in{aTag['href']}"
-            tickertape_links[sTag.text] = tLink
+
+    if members.constituents:
+
+        async def fetch_stock_data(member, retry=False):
+            apiTicker = member["ticker"]
             base_api_url = (
                 f"https://analyze.api.tickertape.in/stocks/scorecard/{apiTicker}"
             )
@@ -86,55 +100,60 @@ def getStockList(
             composite_score = 0
             price = 0
             try:
-                res = fetch_all([base_api_url, price_url])
-                if res[0].ok:
-                    res_json = res[0].json()
-                    score_card = {
-                        item["name"]: item["colour"] for item in res_json["data"]
-                    }
-                    composite_score = score_stock(score_card)
-                else:
-                    logging.info("Reponse failed to get data for %s", apiTicker)
-                if res[1].ok:
-                    price_data = res[1].json()
-                    ## add price data
-                    price = price_data["data"][0]["points"][-1]["lp"]
+                res = await fetch_all([base_api_url, price_url])
+                ## decode off the event loop, it is shared with every other fetch
+                (
+                    score_card,
+                    composite_score,
+                    price,
+                ) = await asyncio.get_running_loop().run_in_executor(
+                    None, parse_stock_data, apiTicker, res
+                )
             except Exception as e:  ##pylint: disable=broad-exception-caught
                 logging.error(e)
                 logging.error("Failed to get data for %s", apiTicker)
                 ## add to retry queue
                 if not retry:
-                    retries[s] = 3
+                    retries[member["symbol"]] = (member, 3)
                 else:
-                    retries[s] -= 1
+                    retries[member["symbol"]] = (
+                        member,
+                        retries[member["symbol"]][1] - 1,
+                    )
                     logging.info(
-                        "Again will retry %s %d time(s)", sTag.text, retries[s]
+                        "Again will retry %s %d time(s)",
+                        member["symbol"],
+                        retries[member["symbol"]][1],
                     )
 
             results.append(
                 {
-                    "stock": aTag.text,
-                    "symbol": sTag.text,
+                    "stock": member["name"],
+                    "symbol": member["symbol"],
                     "score_card": score_card,
-                    "link": tLink,
+                    "link": member["link"],
                     "composite_score": composite_score,
                     "price": price,
                 }
             )
 
-        # Use ThreadPoolExecutor for concurrent fetching
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            list(tqdm(executor.map(fetch_stock_data, subTables), total=len(subTables)))
-        ## retry failed requests
-        for key, value in retries.items():
-            if value > 0:
-                fetch_stock_data(key, retry=True)
-            else:
-                logging.info("Failed to fetch data for %s after 3 retries", key.text)
+        # Fetch all symbols concurrently on the shared event loop
+        async def fetch_all_stocks():
+            tasks = [fetch_stock_data(member) for member in members.constituents]
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+                await task
+            ## retry failed requests
+            for symbol, (member, value) in list(retries.items()):
+                ## retries share the fetcher's budget with every other scraper
+                if value > 0 and fetcher.retry_budget.try_spend():
+                    await fetch_stock_data(member, retry=True)
+                else:
+                    logging.info("Failed to fetch data for %s after 3 retries", symbol)
+
+        fetcher.run(fetch_all_stocks())
+        logging.info("Fetch stats: %s", fetcher.stats())
     else:
         logging.info("Failed to get data from %s", baseUrl)
-        ### show error message
-        logging.info(res.text)
     ## sort by composite score, if same use price lower first
     results.sort(key=lambda x: (x["composite_score"], -x["price"]), reverse=True)
     return results
@@ -0,0 +1,241 @@
+"""
+Vectorised cross-sectional scoring of a universe.
+
+The universe is packed into a (stocks x factors x horizons) feature tensor:
+raw return, percent off VWAP and tent-mapped RSI for 1y/1mo/1w. Horizon
+weighting, z-scoring and the blend are then a few array operations, instead
+of per-stock dict work, so scoring stays cheap at thousands of symbols.
+
+Sums run left to right (explicit adds across the small axes, `np.cumsum`
+along the stock axis) in the same order as the scalar code in `get_stocks`,
+so scores are bit-identical to it. Rows that cannot be scored (missing or
+non-finite fields, zero price) get a score of 0 and are left out of the
+cross-sectional statistics.
+"""
+
+import io
+
+import numpy as np
+
+HORIZONS = ("1y", "1mo", "1w")
+FACTORS = ("returns", "vwap", "rsi")
+HORIZON_WEIGHTS = (0.35, 0.40, 0.25)  # 1y, 1mo, 1w
+BLEND_WEIGHTS = (0.4, 0.3, 0.3)  # returns, vwap, rsi
+
+
+def rsi_tent(rsi):
+    """Array version of `get_stocks._rsi_tent`: rewards 50-65, penalises >75."""
+    rsi = np.asarray(rsi, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        return np.select(
+            [rsi <= 30, rsi <= 50, rsi <= 65, rsi <= 80],
+            [
+                -1.0 + (rsi / 30.0) * 0.5,
+                -0.5 + (rsi - 30) / 20.0 * 0.5,
+                (rsi - 50) / 15.0,
+                1.0 - (rsi - 65) / 15.0 * 1.5,
+            ],
+            -0.5 - (rsi - 80) / 20.0 * 0.5,
+        )
+
+
+def pack(results):
+    """Raw inputs of a list of stock dicts as arrays.
+    @return prices (N,), returns, vwaps, rsis as (N x horizons), NaN where missing
+    """
+    packed = np.full((len(results), 1 + 3 * len(HORIZONS)), np.nan)
+    for i, stock in enumerate(results):
+        try:
+            returns = stock["returns"]
+            y, mo, w = returns["1y"], returns["1mo"], returns["1w"]
+            packed[i] = (
+                stock["price"],
+                y["return"],
+                mo["return"],
+                w["return"],
+                y["vwap"],
+                mo["vwap"],
+                w["vwap"],
+                y["rsi"],
+                mo["rsi"],
+                w["rsi"],
+            )
+        except (KeyError, TypeError, ValueError):
+            ## the row stays NaN and is scored as invalid
+            continue
+    return packed[:, 0], packed[:, 1:4], packed[:, 4:7], packed[:, 7:10]
+
+
+def features(prices, returns, vwaps, rsis):
+    """Feature tensor and validity mask.
+    @return X (N x factors x horizons), valid (N,) bool
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct_off_vwap = (prices[:, None] - vwaps) / prices[:, None] * 100.0
+    X = np.stack([returns, pct_off_vwap, rsi_tent(rsis)], axis=1)
+    valid = np.isfinite(X).all(axis=(1, 2)) & (prices != 0)
+    return X, valid
+
+
+def weight_horizons(X, horizon_weights=HORIZON_WEIGHTS):
+    """Horizon-weighted factors (N x factors), summed 1y, 1mo, 1w like the scalar code."""
+    weighted = X[:, :, 0] * horizon_weights[0]
+    for h in range(1, X.shape[2]):
+        weighted = weighted + X[:, :, h] * horizon_weights[h]
+    return weighted
+
+
+def _stats(values):
+    """Mean and population std with sequential sums, std 0 maps to 1."""
+    n = len(values)
+    mean = float(np.cumsum(values)[-1]) / n
+    sd = (float(np.cumsum((values - mean) ** 2)[-1]) / n) ** 0.5
+    return mean, sd if sd > 0 else 1.0
+
+
+def composite(X, valid, horizon_weights=HORIZON_WEIGHTS, blend_weights=BLEND_WEIGHTS):
+    """Blended cross-sectional z-score of every row, 0 for invalid rows."""
+    scores = np.zeros(X.shape[0])
+    if not valid.any():
+        return scores
+    weighted = weight_horizons(X[valid], horizon_weights)
+    blended = None
+    for f, weight in enumerate(blend_weights):
+        mean, sd = _stats(weighted[:, f])
+        term = weight * ((weighted[:, f] - mean) / sd)
+        blended = term if blended is None else blended + term
+    scores[valid] = blended
+    return scores
+
+
+def score(results, horizon_weights=HORIZON_WEIGHTS, blend_weights=BLEND_WEIGHTS):
+    """Set composite_score and the normalized_* component lists on every stock."""
+    X, valid = features(*pack(results))
+    scores = composite(X, valid, horizon_weights, blend_weights)
+    ## back to Python floats in bulk, per element numpy scalars are slow
+    for stock, row, is_valid, value in zip(
+        results, X.tolist(), valid.tolist(), scores.tolist()
+    ):
+        if is_valid:
+            stock["normalized_returns"] = row[0]
+            stock["normalized_vwap"] = row[1]
+            stock["normalized_rsi"] = row[2]
+            stock["composite_score"] = value
+        else:
+            stock["composite_score"] = 0
+    return scores
+
+
+def top_affordable(scores, prices, n, investment, weight):
+    """Indices of the n best scored stocks that can buy at least one share.
+    A stock is affordable if `int(investment * weight / 100.0 / price) > 0`.
+    Only the candidates that can make the cut are sorted, best first, and
+    ties keep their universe order.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = investment * weight / 100.0 / prices
+    candidates = np.flatnonzero(np.isfinite(shares) & (shares >= 1))
+    if n <= 0 or not len(candidates):
+        return candidates[:0]
+    candidate_scores = np.nan_to_num(scores[candidates], nan=-np.inf)
+    if len(candidates) > n:
+        ## n-th best score, keep everything at or above it so ties stay stable
+        kth = np.partition(candidate_scores, len(candidates) - n)[len(candidates) - n]
+        keep = candidate_scores >= kth
+        candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+    order = np.lexsort((candidates, -candidate_scores))[:n]
+    return candidates[order]
+
+
+class FactorMatrix:
+    """Centered feature matrix of a day, scored against many weightings at once.
+
+    For blend weights `wb` and horizon weights `wh`, factor f of a stock is
+    `X_f @ wh`, whose cross-sectional std is `sqrt(wh' S_f wh)` with `S_f`
+    the population covariance of the factor's horizons. The composite of
+    every weighting k is therefore one product `Xc @ C` with the centered
+    (N x factors*horizons) features `Xc` and
+    `C[f * horizons + h, k] = wb[k, f] * wh[k, h] / sd[k, f]`.
+    Scores agree with `composite` up to floating point rounding.
+    """
+
+    def __init__(self, symbols, X, valid):
+        self.symbols = np.asarray(symbols, dtype=str)
+        self.valid = np.asarray(valid, dtype=bool)
+        rows = np.asarray(X, dtype=np.float64)[self.valid]
+        n_factors, n_horizons = rows.shape[1], rows.shape[2]
+        self.centered = (rows - rows.mean(axis=0)).reshape(
+            len(rows), n_factors * n_horizons
+        )
+        ## per factor horizon covariance, (factors x horizons x horizons)
+        per_factor = self.centered.reshape(len(rows), n_factors, n_horizons)
+        self.covariance = np.einsum("nfh,nfg->fhg", per_factor, per_factor) / max(
+            len(rows), 1
+        )
+
+    @classmethod
+    def from_arrays(cls, symbols, prices, returns, vwaps, rsis):
+        X, valid = features(prices, returns, vwaps, rsis)
+        return cls(symbols, X, valid)
+
+    @classmethod
+    def from_records(cls, results):
+        return cls.from_arrays([s.get("symbol", "") for s in results], *pack(results))
+
+    def coefficients(self, blend_weights, horizon_weights):
+        """(factors*horizons x K) matrix C for K weightings given as K x 3 arrays."""
+        wb = np.atleast_2d(np.asarray(blend_weights, dtype=np.float64))
+        wh = np.atleast_2d(np.asarray(horizon_weights, dtype=np.float64))
+        variance = np.einsum("kh,fhg,kg->kf", wh, self.covariance, wh)
+        sd = np.sqrt(np.clip(variance, 0.0, None))
+        ## a constant factor has no spread, like the scalar code divide by 1
+        sd[sd <= 1e-12] = 1.0
+        C = (wb / sd)[:, :, None] * wh[:, None, :]
+        return C.reshape(len(wb), -1).T
+
+    def scores(self, blend_weights=BLEND_WEIGHTS, horizon_weights=HORIZON_WEIGHTS):
+        """Composite scores (N x K), 0 for rows that could not be scored."""
+        blend_weights = np.atleast_2d(blend_weights)
+        horizon_weights = np.atleast_2d(horizon_weights)
+        k = max(len(blend_weights), len(horizon_weights))
+        blend_weights = np.broadcast_to(blend_weights, (k, len(FACTORS)))
+        horizon_weights = np.broadcast_to(horizon_weights, (k, len(HORIZONS)))
+        scores = np.zeros((len(self.valid), k))
+        scores[self.valid] = self.centered @ self.coefficients(
+            blend_weights, horizon_weights
+        )
+        return scores
+
+    def top_n(self, scores, n):
+        """Row indices of the n best scores of every column, best first."""
+        n = min(n, scores.shape[0])
+        if n <= 0:
+            return np.empty((scores.shape[1], 0), dtype=np.int64)
+        ## partial partition, then order only the n picked rows
+        picked = np.argpartition(-scores, n - 1, axis=0)[:n]
+        order = np.argsort(-np.take_along_axis(scores, picked, axis=0), axis=0)
+        return np.take_along_axis(picked, order, axis=0).T
+
+    def encode(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            symbols=self.symbols,
+            valid=self.valid,
+            centered=self.centered,
+            covariance=self.covariance,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def decode(cls, data: bytes):
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            matrix = cls.__new__(cls)
+            matrix.symbols = npz["symbols"]
+            matrix.valid = npz["valid"]
+            matrix.centered = npz["centered"]
+            matrix.covariance = npz["covariance"]
+        return matrix
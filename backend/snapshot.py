@@ -0,0 +1,95 @@
+"""
+Columnar universe snapshot.
+
+The daily universe is stored as a compressed `.npz` with one array per field
+instead of a list of nested dicts. Members of an npz are decompressed on
+access only, so readers that need a couple of columns (e.g. `symbol` and
+`price` for a price list) never decode the rest.
+"""
+
+import io
+
+import numpy as np
+
+SCHEMA_VERSION = 1
+HORIZONS = ("1y", "1mo", "1w")
+FIELDS = ("return", "vwap", "rsi")
+NORMALIZED = ("normalized_returns", "normalized_vwap", "normalized_rsi")
+
+
+def _column(horizon, field):
+    return f"returns_{horizon}_{field}"
+
+
+def encode(records) -> bytes:
+    """Encode a list of stock dicts (as built by getStockList) to npz bytes."""
+    columns = {
+        "schema_version": np.array(SCHEMA_VERSION),
+        "symbol": np.array([r["symbol"] for r in records], dtype=str),
+        "stock": np.array([r["stock"] for r in records], dtype=str),
+        "price": np.array([r["price"] for r in records], dtype=np.float64),
+        "composite_score": np.array(
+            [r.get("composite_score", 0) for r in records], dtype=np.float64
+        ),
+    }
+    for horizon in HORIZONS:
+        for field in FIELDS:
+            columns[_column(horizon, field)] = np.array(
+                [r["returns"][horizon][field] for r in records], dtype=np.float64
+            )
+    for name in NORMALIZED:
+        ## stocks that could not be scored carry no normalized components
+        columns[name] = np.array(
+            [r.get(name, [np.nan] * len(HORIZONS)) for r in records],
+            dtype=np.float64,
+        ).reshape(len(records), len(HORIZONS))
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **columns)
+    return buffer.getvalue()
+
+
+def decode(data: bytes, columns=None):
+    """Decode npz bytes into a dict of column arrays.
+    @param columns: names of the columns to read, None for all of them
+    """
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        version = int(npz["schema_version"])
+        if version > SCHEMA_VERSION:
+            raise ValueError(f"Unsupported snapshot schema version {version}")
+        names = npz.files if columns is None else columns
+        return {name: npz[name] for name in names if name != "schema_version"}
+
+
+def to_records(columns, rows=None):
+    """Rebuild stock dicts from a full set of columns.
+    @param rows: row indices to rebuild, None for all rows in order
+    """
+    if rows is None:
+        rows = range(len(columns["symbol"]))
+    records = []
+    for i in rows:
+        record = {
+            "stock": str(columns["stock"][i]),
+            "symbol": str(columns["symbol"][i]),
+            "returns": {
+                horizon: {
+                    field: float(columns[_column(horizon, field)][i])
+                    for field in FIELDS
+                }
+                for horizon in HORIZONS
+            },
+            "price": float(columns["price"][i]),
+        }
+        for name in NORMALIZED:
+            values = columns[name][i]
+            if not np.isnan(values).all():
+                record[name] = values.tolist()
+        record["composite_score"] = float(columns["composite_score"][i])
+        records.append(record)
+    return records
+
+
+def price_list(data: bytes):
+    """Symbol to price map, reading only those two columns."""
+    columns = decode(data, ["symbol", "price"])
+    return dict(zip(columns["symbol"].tolist(), columns["price"].tolist()))
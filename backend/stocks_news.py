@@ -1,18 +1,18 @@
 """Parallel web scraper for stock news from MoneyControl."""
 
 import argparse
+import asyncio
 import json
 import logging
-import os
 import csv
 import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
 
-import requests
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
+from fetcher import FetchError, get_fetcher
+
 
 # Configure logging
 logging.basicConfig(
@@ -35,19 +35,23 @@ class StockNewsScraper:
         self.stock_news = []
         self.back_days = back_days
 
-    def fetch_page(self, url):
-        """Fetches the content of a webpage."""
+    async def fetch_page_async(self, url):
+        """Coroutine: fetches the content of a webpage on the shared event loop."""
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
+            response = await get_fetcher().fetch(url)
+            if not response.ok:
+                raise FetchError(f"{url}: status {response.status_code}")
             return response.content
-        except requests.exceptions.RequestException as error:
+        except FetchError as error:
             logging.error("Error fetching %s: %s", url, error)
             return None
 
-    def parse_article(self, url):
-        """Parses details from the article page."""
-        content = self.fetch_page(url)
+    def fetch_page(self, url):
+        """Fetches the content of a webpage."""
+        return get_fetcher().run(self.fetch_page_async(url))
+
+    def parse_article(self, url, content):
+        """Parses details from the article page, off the fetcher event loop."""
         if content is None:
             return None
 
@@ -140,34 +144,38 @@ class StockNewsScraper:
             return None
 
         entries = self.parse_main_page(content)
-        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-            future_to_entry = {
-                executor.submit(self.parse_article, entry[1]): entry
-                for entry in entries
-            }
-            for future in tqdm(
-                as_completed(future_to_entry),
-                total=len(future_to_entry),
-                desc="Processing articles",
-            ):
-                entry = future_to_entry[future]
-                try:
-                    article_info = future.result()
-                    if article_info:
-                        self.stock_news.append(
-                            {
-                                "published_date": entry[0],
-                                "url": entry[1],
-                                "broker": entry[2].split(":")[-1],
-                                "recommendation": entry[2].split(":")[0].split(" ")[0],
-                                "stock": " ".join(
-                                    entry[2].split(";")[0].split(" ")[1:]
-                                ),
-                                "target_price": float(article_info["target_price"]),
-                            }
-                        )
-                except Exception as error:  # pylint: disable=broad-except
-                    logging.error("Error processing entry %s: %s", entry, error)
+
+        async def fetch_all():
+            return await asyncio.gather(
+                *[self.fetch_page_async(entry[1]) for entry in entries],
+                return_exceptions=True,
+            )
+
+        ## I/O is bounded per host by the shared fetcher, not by the CPU count;
+        ## the pages are parsed here so the loop only waits on sockets
+        contents = get_fetcher().run(fetch_all())
+        for entry, content in tqdm(
+            zip(entries, contents),
+            total=len(entries),
+            desc="Processing articles",
+        ):
+            try:
+                if isinstance(content, Exception):
+                    raise content
+                article_info = self.parse_article(entry[1], content)
+                if article_info:
+                    self.stock_news.append(
+                        {
+                            "published_date": entry[0],
+                            "url": entry[1],
+                            "broker": entry[2].split(":")[-1],
+                            "recommendation": entry[2].split(":")[0].split(" ")[0],
+                            "stock": " ".join(entry[2].split(";")[0].split(" ")[1:]),
+                            "target_price": float(article_info["target_price"]),
+                        }
+                    )
+            except Exception as error:  # pylint: disable=broad-except
+                logging.error("Error processing entry %s: %s", entry, error)
 
         return self.stock_news
 
@@ -220,8 +228,9 @@ def test():
 
     try:
         # Send HTTP request
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
+        response = get_fetcher().get(url, headers=headers)
+        if not response.ok:
+            raise FetchError(f"{url}: status {response.status_code}")
 
         # Parse HTML content
         soup = BeautifulSoup(response.text, "html.parser")
@@ -259,9 +268,7 @@ def test():
                     r"dated\s([A-Za-z]+)\s(\d{1,2}),\s(\d{4})", desc_tag.text
                 )
                 if date_match:
-                    published_date = (
-                        f"{date_match.group(1)} {date_match.group(2)}, {date_match.group(3)}"
-                    )
+                    published_date = f"{date_match.group(1)} {date_match.group(2)}, {date_match.group(3)}"
 
             data.append(
                 {
@@ -278,7 +285,7 @@ def test():
         data.sort(key=lambda x: (x["stock"], x["published_date"]))
         return data
 
-    except requests.RequestException as e:
+    except FetchError as e:
         logging.error("Error fetching data: %s", e)
         return []
 
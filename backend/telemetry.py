@@ -0,0 +1,124 @@
+"""
+Per-symbol ingestion telemetry of a getStockList run.
+
+Every HTTP attempt of every symbol and duration is recorded with its latency,
+the time it spent queued behind the rate limiter, its bytes and outcome, and
+every constituent that did not make it into the results is recorded with the
+reason. `RunReport.to_dict` turns that into the JSON run report that is stored
+next to the daily snapshot, with latency percentiles and the slowest requests
+on top.
+"""
+
+import datetime
+import time
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+SLOWEST_N = 10
+
+
+def latency_summary(latencies):
+    """Count, mean and p50/p95/p99 of a list of latencies in seconds."""
+    if not latencies:
+        return {"count": 0}
+    values = np.asarray(latencies, dtype=np.float64)
+    summary = {"count": len(latencies), "mean": round(float(values.mean()), 4)}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}"] = round(float(value), 4)
+    summary["max"] = round(float(values.max()), 4)
+    return summary
+
+
+class RunReport:
+    """Collects attempts and drops; only touched from the fetcher's event loop."""
+
+    def __init__(self, name="getStockList"):
+        self.name = name
+        self.started_at = datetime.datetime.now()
+        self._start = time.perf_counter()
+        self.elapsed = None
+        self.attempts = {}
+        self.dropped = {}
+        self.universe = 0
+
+    def attempt(self, symbol, duration, total, response=None, error=None):
+        """Record one HTTP attempt.
+        @param total: seconds the attempt took, including rate limiter waits
+        @param response: FetchResponse if one was received
+        @param error: failure reason if the attempt failed
+        """
+        ## latency of the request itself, the rest was spent queued
+        latency = (
+            total if response is None or not response.elapsed else response.elapsed
+        )
+        self.attempts.setdefault((symbol, duration), []).append(
+            {
+                "latency": round(latency, 4),
+                "wait": round(max(total - latency, 0.0), 4),
+                "bytes": len(response.content) if response is not None else 0,
+                "error": None if error is None else str(error),
+            }
+        )
+
+    def drop(self, symbol, reason):
+        """Record a constituent missing from the results."""
+        self.dropped.setdefault(symbol, str(reason))
+
+    def finish(self, universe):
+        self.universe = universe
+        self.elapsed = time.perf_counter() - self._start
+
+    def to_dict(self, slowest_n=SLOWEST_N):
+        symbols = {}
+        requests = []
+        for (symbol, duration), attempts in self.attempts.items():
+            entry = {
+                "attempts": len(attempts),
+                "latency": round(sum(a["latency"] for a in attempts), 4),
+                "wait": round(sum(a["wait"] for a in attempts), 4),
+                "bytes": sum(a["bytes"] for a in attempts),
+                "ok": attempts[-1]["error"] is None,
+                "errors": [a["error"] for a in attempts if a["error"] is not None],
+            }
+            symbols.setdefault(symbol, {})[duration] = entry
+            requests.append((entry["latency"], symbol, duration, entry["attempts"]))
+
+        all_latencies = [
+            a["latency"] for attempts in self.attempts.values() for a in attempts
+        ]
+        by_duration = {}
+        for (_, duration), attempts in self.attempts.items():
+            by_duration.setdefault(duration, []).extend(a["latency"] for a in attempts)
+        requests.sort(reverse=True)
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "elapsed": None if self.elapsed is None else round(self.elapsed, 3),
+            "universe": self.universe,
+            "fetched": self.universe - len(self.dropped),
+            "dropped": self.dropped,
+            "requests": len(all_latencies),
+            "retries": len(all_latencies) - len(self.attempts),
+            "bytes": sum(
+                a["bytes"] for attempts in self.attempts.values() for a in attempts
+            ),
+            "latency": latency_summary(all_latencies),
+            "wait": latency_summary(
+                [a["wait"] for attempts in self.attempts.values() for a in attempts]
+            ),
+            "latency_by_duration": {
+                duration: latency_summary(latencies)
+                for duration, latencies in sorted(by_duration.items())
+            },
+            "slowest": [
+                {
+                    "symbol": symbol,
+                    "duration": duration,
+                    "latency": latency,
+                    "attempts": attempts,
+                }
+                for latency, symbol, duration, attempts in requests[:slowest_n]
+            ],
+            "symbols": symbols,
+        }
@@ -0,0 +1,166 @@
+"""
+NSE trading calendar and the manifest of dated blobs.
+
+Trading days are the weekdays that are not NSE holidays. The holidays of the
+years below are taken from the NSE holiday circulars; `NSE_HOLIDAYS` (env,
+comma separated YYYY-MM-DD dates) adds more, e.g. for a year not listed yet.
+
+The generate job records the date of every dated blob it writes in one
+manifest blob, keyed by the blob name before the date, e.g. `portfolio-on`
+for `portfolio-on-2025-01-02.json`. "Previous available day" and "available
+days of a range" are then lookups in memory instead of probing blob after
+blob, and a trading day missing from the manifest tells a gap in the history
+apart from a weekend or holiday.
+"""
+
+import bisect
+import datetime
+import os
+
+HOLIDAYS = frozenset(
+    [
+        ## 2024
+        "2024-01-22",
+        "2024-01-26",
+        "2024-03-08",
+        "2024-03-25",
+        "2024-03-29",
+        "2024-04-11",
+        "2024-04-17",
+        "2024-05-01",
+        "2024-05-20",
+        "2024-06-17",
+        "2024-07-17",
+        "2024-08-15",
+        "2024-10-02",
+        "2024-11-01",
+        "2024-11-15",
+        "2024-11-20",
+        "2024-12-25",
+        ## 2025
+        "2025-02-26",
+        "2025-03-14",
+        "2025-03-31",
+        "2025-04-10",
+        "2025-04-14",
+        "2025-04-18",
+        "2025-05-01",
+        "2025-08-15",
+        "2025-08-27",
+        "2025-10-02",
+        "2025-10-21",
+        "2025-10-22",
+        "2025-11-05",
+        "2025-12-25",
+        ## 2026
+        "2026-01-26",
+        "2026-03-03",
+        "2026-03-26",
+        "2026-03-31",
+        "2026-04-03",
+        "2026-04-14",
+        "2026-05-01",
+        "2026-05-28",
+        "2026-06-26",
+        "2026-09-14",
+        "2026-10-02",
+        "2026-10-20",
+        "2026-11-10",
+        "2026-11-24",
+        "2026-12-25",
+    ]
+)
+
+## Read from the environment variable
+HOLIDAYS = HOLIDAYS | frozenset(
+    date.strip() for date in os.getenv("NSE_HOLIDAYS", "").split(",") if date.strip()
+)
+
+MANIFEST_SCHEMA_VERSION = 1
+MANIFEST_BLOB_NAME = "manifest/dates.json"
+
+
+def _as_date(date) -> datetime.date:
+    if isinstance(date, datetime.datetime):
+        return date.date()
+    if isinstance(date, datetime.date):
+        return date
+    return datetime.datetime.strptime(date, "%Y-%m-%d").date()
+
+
+def is_trading_day(date) -> bool:
+    """True for a weekday that is not an NSE holiday; takes a date or YYYY-MM-DD."""
+    date = _as_date(date)
+    return date.weekday() < 5 and date.strftime("%Y-%m-%d") not in HOLIDAYS
+
+
+def previous_trading_day(date) -> str:
+    """Last trading day before a date, as YYYY-MM-DD."""
+    date = _as_date(date) - datetime.timedelta(days=1)
+    while not is_trading_day(date):
+        date -= datetime.timedelta(days=1)
+    return date.strftime("%Y-%m-%d")
+
+
+def trading_days(start_date, end_date) -> list:
+    """Trading days from start_date to end_date, both included, as YYYY-MM-DD."""
+    date, end_date = _as_date(start_date), _as_date(end_date)
+    days = []
+    while date <= end_date:
+        if is_trading_day(date):
+            days.append(date.strftime("%Y-%m-%d"))
+        date += datetime.timedelta(days=1)
+    return days
+
+
+class DateManifest:
+    """Sorted YYYY-MM-DD dates of the blobs of every tracked name prefix."""
+
+    def __init__(self, dates=None):
+        self._dates = {}
+        self._index = {}
+        for prefix, prefix_dates in (dates or {}).items():
+            self.track(prefix, prefix_dates)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Manifest of a stored blob, an empty one for None or another schema."""
+        if not data or data.get("schema_version") != MANIFEST_SCHEMA_VERSION:
+            return cls()
+        return cls(data.get("dates"))
+
+    def to_dict(self):
+        return {"schema_version": MANIFEST_SCHEMA_VERSION, "dates": self._dates}
+
+    def tracks(self, prefix) -> bool:
+        return prefix in self._dates
+
+    def track(self, prefix, dates):
+        """Replace the dates of a prefix, e.g. with the dates of a blob listing."""
+        self._dates[prefix] = sorted(set(dates))
+        self._index[prefix] = {date: i for i, date in enumerate(self._dates[prefix])}
+
+    def add(self, prefix, date) -> bool:
+        """Record a blob date, False if it was recorded already."""
+        if date in self._index.get(prefix, ()):
+            return False
+        self.track(prefix, self._dates.get(prefix, []) + [date])
+        return True
+
+    def has(self, prefix, date) -> bool:
+        return date in self._index.get(prefix, ())
+
+    def dates(self, prefix, start_date=None, end_date=None) -> list:
+        """Recorded dates of a prefix within [start_date, end_date], in order."""
+        dates = self._dates.get(prefix, [])
+        lo = 0 if start_date is None else bisect.bisect_left(dates, start_date)
+        hi = len(dates) if end_date is None else bisect.bisect_right(dates, end_date)
+        return dates[lo:hi]
+
+    def previous(self, prefix, date):
+        """Last recorded date of a prefix before a date, None if there is none."""
+        dates = self._dates.get(prefix, [])
+        i = self._index.get(prefix, {}).get(date)
+        if i is None:
+            i = bisect.bisect_left(dates, date)
+        return dates[i - 1] if i > 0 else None
@@ -0,0 +1,94 @@
+"""
+Registry of the index universes a generate run can build.
+
+A universe is an index whose constituents page on tickertape lists the
+members; its tickertape id (e.g. `.NIFTY200`) is the last part of the page
+slug. Every universe gets its own snapshot, factor matrix and portfolio blobs.
+Nifty 200, the universe the app was built around, keeps the blob names it
+always had; the others are prefixed with their name.
+
+`GENERATE_UNIVERSES` (env `UNIVERSES`, comma separated names) picks the
+universes built by the daily generate run and refreshed intraday.
+"""
+
+import os
+
+from constituents import TICKERTAPE_URL
+
+DEFAULT = "nifty200"
+
+
+class Universe:
+    """An index and the names of the blobs built for it."""
+
+    def __init__(self, name, label, slug):
+        self.name = name
+        self.label = label
+        self.slug = slug
+
+    @property
+    def url(self):
+        """Constituents page of the index."""
+        return f"{TICKERTAPE_URL}/indices/{self.slug}/constituents?type=marketcap"
+
+    @property
+    def ticker(self):
+        """Tickertape id of the index itself."""
+        return self.slug.split("-")[-1]
+
+    def blob_name(self, name):
+        """Per universe name of a blob outside all_symbols/, e.g. portfolios."""
+        return name if self.name == DEFAULT else f"{self.name}/{name}"
+
+    def all_symbols_blob_name(self, name):
+        """Per universe name of an all_symbols/ blob, e.g. factor matrices."""
+        if self.name == DEFAULT:
+            return f"all_symbols/{name}"
+        return f"all_symbols/{self.name}-{name}"
+
+    @property
+    def snapshot_prefix(self):
+        """Name of the daily snapshot blobs before their date."""
+        return f"all_symbols/{self.name}-symbols"
+
+    def snapshot_base_name(self, request_date):
+        return f"{self.snapshot_prefix}-{request_date}"
+
+    def index_data_blob_name(self):
+        return f"all_symbols/{self.name}-data.json"
+
+    def __repr__(self):
+        return f"Universe({self.name!r})"
+
+
+UNIVERSES = {
+    universe.name: universe
+    for universe in (
+        Universe("nifty50", "Nifty 50", "nifty-50-index-.NSEI"),
+        Universe("nifty100", "Nifty 100", "nifty-100-index-.NIFTY100"),
+        Universe("nifty200", "Nifty 200", "nifty-200-index-.NIFTY200"),
+        Universe("nifty500", "Nifty 500", "nifty-500-index-.NIFTY500"),
+        Universe("niftybank", "Nifty Bank", "nifty-bank-index-.NSEBANK"),
+        Universe("niftyit", "Nifty IT", "nifty-it-index-.NIFTYIT"),
+        Universe("niftypharma", "Nifty Pharma", "nifty-pharma-index-.NIFTYPHARMA"),
+        Universe("niftyauto", "Nifty Auto", "nifty-auto-index-.NIFTYAUTO"),
+        Universe("niftyfmcg", "Nifty FMCG", "nifty-fmcg-index-.NIFTYFMCG"),
+        Universe("niftymetal", "Nifty Metal", "nifty-metal-index-.NIFTYMETAL"),
+    )
+}
+
+
+def get_universe(name=None) -> Universe:
+    """Registered universe of a name, the default one for None."""
+    try:
+        return UNIVERSES[name or DEFAULT]
+    except KeyError:
+        raise ValueError(f"Unknown universe {name}") from None
+
+
+## Read from the environment variable
+GENERATE_UNIVERSES = [
+    get_universe(name.strip())
+    for name in os.getenv("UNIVERSES", DEFAULT).split(",")
+    if name.strip()
+]
@@ -1,18 +1,47 @@
 """
 This module provides a decorator for caching function results.
+
+Results are cached in two tiers: `memory_cache` in the process (L1) in front
+of Redis (L2) when it is reachable. `memory_cache` is a thread-safe LRU
+bounded by entry count and by approximate bytes, with a TTL per entry, so a
+long running process stays flat in memory; it also keeps per process data
+such as blob ETags. A miss is computed once per key: callers in the process
+wait for the first one (`single_flight`, also used by the blob reads that
+do not go through `cache_results`), and other replicas wait on its Redis lock.
 """
 
+import collections
 import functools
 import logging
 import redis
 import os
-import json
+import sys
+import threading
+import time
+
+import codec
 
 logging = logging.getLogger(__name__)
 
 ## Read from the environment variable
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+CACHE_TTL = 300
+## None results (e.g. a blob not uploaded yet) expire sooner
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", 15))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+CACHE_MAX_MB = int(os.getenv("CACHE_MAX_MB", 256))
+## process copy of a Redis entry, seconds
+L1_CACHE_TTL = int(os.getenv("L1_CACHE_TTL", 30))
+## Redis lock of a key being computed: expiry, how long other replicas wait
+## for the value and how often they look for it, seconds
+CACHE_LOCK_TIMEOUT = int(os.getenv("CACHE_LOCK_TIMEOUT", 60))
+CACHE_LOCK_WAIT = int(os.getenv("CACHE_LOCK_WAIT", 30))
+CACHE_LOCK_POLL = 0.05
+## payload format of the Redis entries, e.g. msgpack+lz4, see codec.Serializer
+REDIS_SERIALIZER = codec.Serializer(
+    os.getenv("REDIS_SERIALIZER", codec.default_serializer())
+)
 
 try:
     redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
@@ -23,50 +52,341 @@ except redis.exceptions.ConnectionError:
     redis_client = None
 
 
+def approximate_size(value) -> int:
+    """Rough bytes of a value, sys.getsizeof summed over nested containers,
+    object attributes and array buffers (`nbytes`), each object counted once."""
+    size = 0
+    seen = set()
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        nbytes = getattr(item, "nbytes", None)
+        ## an array view does not own its buffer, getsizeof leaves it out
+        size += max(sys.getsizeof(item), nbytes if isinstance(nbytes, int) else 0)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__") and not isinstance(item, type):
+            stack.extend(vars(item).values())
+    return size
+
+
+class LRUCache:
+    """Thread-safe LRU bounded by entries and approximate bytes, TTL per entry."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_MB << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        ## key -> (expires at, bytes, value), least recently used first
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key, default=None):
+        """Cached value of a key, `default` if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None:
+                if entry[0] <= time.monotonic():
+                    self._remove(key)
+                    self.expirations += 1
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, ttl=None):
+        """Cache a value for ttl seconds, None keeps it until it is evicted."""
+        size = approximate_size(value)
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                logging.warning("%s is too large to cache (%d bytes)", key, size)
+                return
+            self._entries[key] = (expires, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+## Shared by every cache_results function and BlobService, one memory budget
+memory_cache = LRUCache()
+_MISSING = object()
+
+
+def _ttl(result):
+    return NEGATIVE_CACHE_TTL if result is None else CACHE_TTL
+
+
+class _Flight:
+    """Call of a cached function in progress, its result is shared with waiters."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+## In progress calls by memory cache key, one per key in the process
+_flights_lock = threading.Lock()
+_flights = {}
+
+
+def single_flight(key, func):
+    """Result of `func()`, called once per key at a time in the process:
+    concurrent callers of the same key wait for the first one and share its
+    result or exception. Callers re-check their cache inside `func`, a waiter
+    arriving right after a flight landed starts a new one."""
+    with _flights_lock:
+        flight = _flights.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _flights[key] = _Flight()
+    if not is_leader:
+        logging.info("waiting for the call in progress for %s", key)
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = func()
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def _redis_get(key):
+    """Cached value of a key in Redis, _MISSING on a miss or without Redis."""
+    global redis_client
+    if redis_client is None:
+        return _MISSING
+    try:
+        payload = redis_client.get(key)
+        if payload is not None and len(payload) > 0:
+            logging.info("redis cache hit for %s", key)
+            return REDIS_SERIALIZER.loads(payload)
+        logging.info("redis cache miss for %s", key)
+    except redis.exceptions.ConnectionError:
+        redis_client = None
+    except Exception as e:  ## pylint: disable=broad-exception-caught
+        ## a corrupt entry is a miss, the result is computed and stored again
+        logging.error("Failed to decode %s: %s", key, e)
+    return _MISSING
+
+
+def _redis_set(key, result, ttl=None):
+    global redis_client
+    if redis_client is None:
+        return
+    try:
+        payload = REDIS_SERIALIZER.dumps(result)
+    except (TypeError, ValueError) as e:
+        logging.warning("%s is not serializable, not cached in redis: %s", key, e)
+        return
+    try:
+        redis_client.set(key, payload, ex=ttl or _ttl(result))
+    except redis.exceptions.ConnectionError:
+        redis_client = None
+
+
+def _redis_lock(key):
+    """Acquired Redis lock of a key, None if another replica holds it or
+    without Redis."""
+    global redis_client
+    if redis_client is None:
+        return None
+    try:
+        lock = redis_client.lock(f"lock:{key}", timeout=CACHE_LOCK_TIMEOUT)
+        return lock if lock.acquire(blocking=False) else None
+    except redis.exceptions.ConnectionError:
+        redis_client = None
+        return None
+
+
+def _redis_wait(key):
+    """Value another replica is computing for a key, _MISSING if it does not
+    show up before its lock is released or CACHE_LOCK_WAIT passes."""
+    global redis_client
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_LOCK_POLL)
+        result = _redis_get(key)
+        if result is not _MISSING:
+            return result
+        client = redis_client
+        if client is None:
+            break
+        try:
+            if not client.exists(f"lock:{key}"):
+                return _redis_get(key)
+        except redis.exceptions.ConnectionError:
+            redis_client = None
+            break
+    return _MISSING
+
+
+def _release(lock):
+    global redis_client
+    try:
+        lock.release()
+    except redis.exceptions.LockError:
+        ## expired while the function ran, another replica may hold it now
+        logging.warning("redis lock %s expired before release", lock.name)
+    except redis.exceptions.ConnectionError:
+        redis_client = None
+
+
+def shared_get(key):
+    """Value other replicas stored under a key with `shared_set`, None on a
+    miss or without Redis."""
+    key = f"{REDIS_SERIALIZER.tag}:{key}"
+    result = _redis_get(key)
+    return None if result is _MISSING else result
+
+
+def shared_set(key, value, ttl=CACHE_TTL):
+    """Share a value with the other replicas through Redis for ttl seconds."""
+    _redis_set(f"{REDIS_SERIALIZER.tag}:{key}", value, ttl)
+
+
+def shared_delete(key):
+    global redis_client
+    if redis_client is None:
+        return
+    try:
+        redis_client.delete(f"{REDIS_SERIALIZER.tag}:{key}")
+    except redis.exceptions.ConnectionError:
+        redis_client = None
+
+
 def cache_results(func):
-    cache = {}
+    """Cache the results of a function by its positional arguments, the first
+    one (e.g. a BlobService) left out of the Redis key.
 
-    @functools.wraps(func)
-    def wrapper(*args):
-        global redis_client
-        ## strip off object address
+    Lookups go to the process LRU (L1) first, then to Redis (L2). On a miss
+    one caller per key computes the result, concurrent callers of the process
+    wait for it, and a Redis lock does the same for the other replicas.
+    """
+
+    def _memory_key(args):
+        return (func.__module__, func.__qualname__, args)
+
+    def _key(args):
+        ## strip off object address, the serializer tag keeps entries of
+        ## other payload formats apart
         try:
-            key = f"{func.__name__}:{str(args[1:])}"
+            return f"{REDIS_SERIALIZER.tag}:{func.__name__}:{str(args[1:])}"
         except IndexError:
-            key = f"{func.__name__}:"
+            return f"{REDIS_SERIALIZER.tag}:{func.__name__}:"
+
+    def _remember(args, result):
+        ## with Redis as L2 the process copy is kept short, so the replicas
+        ## see a changed value soon; alone it lives as long as a Redis entry
+        ttl = _ttl(result)
         if redis_client is not None:
-            try:
-                result_str = redis_client.get(key)
-                if result_str is not None and len(result_str) > 0:
-                    result = json.loads(result_str)  # Convert to dict
-                    logging.info("redis cache hit for %s", key)
-                    return result
-                else:
-                    logging.warn("redis cache miss for %s | %s", key, result_str)
-            except redis.exceptions.ConnectionError:
-                redis_client = None
-            except json.decoder.JSONDecodeError as e:
-                logging.error("JSONDecodeError error %s | %s", key, result_str)
-                logging.error(e)
-                redis_client = None
+            ttl = min(ttl, L1_CACHE_TTL)
+        memory_cache.set(_memory_key(args), result, ttl)
 
-        if redis_client is None:
-            if args in cache:
-                logging.info("in-memory cache hit for %s", key)
-                return cache[args]
-            logging.info("in-memory cache miss for %s", key)
-            result = func(*args)
-            cache[args] = result
+    def _compute(args, key):
+        result = _redis_get(key)
+        if result is not _MISSING:
+            _remember(args, result)
             return result
-
-        logging.info("redis cache miss for %s", key)
-        result = func(*args)
+        lock = _redis_lock(key)
+        if lock is None and redis_client is not None:
+            logging.info("waiting for another replica to compute %s", key)
+            result = _redis_wait(key)
+            if result is not _MISSING:
+                _remember(args, result)
+                return result
         try:
-            result_str = json.dumps(result)  # Convert to string
-            redis_client.set(key, result_str, ex=300)  # Cache for 5 min
-            logging.warn("redis cached %s for 1 hour", key)
-        except redis.exceptions.ConnectionError:
-            redis_client = None
+            ## filled in while the lock was taken
+            result = _redis_get(key) if lock is not None else _MISSING
+            if result is _MISSING:
+                result = func(*args)
+                _redis_set(key, result)
+        finally:
+            if lock is not None:
+                _release(lock)
+        _remember(args, result)
         return result
 
+    @functools.wraps(func)
+    def wrapper(*args):
+        key = _key(args)
+        result = memory_cache.get(_memory_key(args), _MISSING)
+        if result is not _MISSING:
+            logging.info("in-memory cache hit for %s", key)
+            return result
+
+        ## single-flight: the first caller of a key computes, the others wait
+        return single_flight(_memory_key(args), lambda: _compute(args, key))
+
+    def prime(result, *args):
+        """Store `result` as the cached value of `func(*args)`, e.g. after a bulk fetch."""
+        _redis_set(_key(args), result)
+        _remember(args, result)
+
+    def invalidate(*args):
+        """Drop the cached value of `func(*args)`, e.g. after its source was uploaded."""
+        global redis_client
+        memory_cache.pop(_memory_key(args))
+        if redis_client is not None:
+            try:
+                redis_client.delete(_key(args))
+            except redis.exceptions.ConnectionError:
+                redis_client = None
+
+    wrapper.prime = prime
+    wrapper.invalidate = invalidate
     return wrapper